@@ -0,0 +1,286 @@
+import perspective_transformation
+import circle_detector_with_cv
+import circle_detector_without_cv
+import result_renderer
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from colorama import Fore, Style
+from math import ceil, floor
+import numpy as np
+import multiprocessing
+import glob
+import json
+import os
+import time
+import cv2
+
+
+class BatchProcessor:
+    # Initialization, parameters are loaded from a JSON file, e.g.
+    # {"detector": "opencv", "method": 1, "minRadius": 20, "maxRadius": 40,
+    #  "objSize": 30, "numOfExpectedCircles": 7, "advancedDetection": true,
+    #  "transformation": {"width": 1438, "height": 1200, "coords": [[253, 572], ...]}}
+    def __init__(self, pParamsFilename: str, pOutputDir: str):
+        with open(pParamsFilename, "r") as file:
+            self.params = json.load(file)
+
+        self.outputDir = pOutputDir
+        self.outputNames = {}
+        self.maxPoolBreaks = 2
+        self.renderer = result_renderer.ResultRenderer()
+        os.makedirs(self.outputDir, exist_ok=True)
+
+    # Returns sorted list of images in the directory
+    # or of images matching the glob pattern
+    def findImages(self, pPath: str) -> list:
+        if os.path.isdir(pPath):
+            filenames = [os.path.join(pPath, name) for name in os.listdir(pPath)]
+            return sorted(name for name in filenames if name.lower().endswith((".jpg", ".jpeg", ".png")))
+
+        return sorted(glob.glob(pPath))
+
+    # Names outputs of the images by their paths relative to the input
+    # directory (or to the common directory of the glob matches).
+    # Images differing only in their extension keep it in the name.
+    def setOutputNames(self, pPath: str, pImageFilenames: list):
+        self.outputNames = {}
+        if not pImageFilenames:
+            return
+
+        if os.path.isdir(pPath):
+            root = os.path.abspath(pPath)
+        else:
+            root = os.path.commonpath([os.path.dirname(os.path.abspath(name)) for name in pImageFilenames])
+
+        names = [os.path.splitext(os.path.relpath(os.path.abspath(name), root)) for name in pImageFilenames]
+        stems = [stem for stem, extension in names]
+        for imageFilename, (stem, extension) in zip(pImageFilenames, names):
+            self.outputNames[imageFilename] = stem if stems.count(stem) == 1 else stem + "_" + extension[1:]
+
+    # Returns path of the output file belonging to the image,
+    # directories of the output are created if needed
+    def getOutputFilename(self, pImageFilename: str, pSuffix: str) -> str:
+        name = self.outputNames.get(pImageFilename, os.path.splitext(os.path.basename(pImageFilename))[0])
+        filename = os.path.join(self.outputDir, name + pSuffix)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+
+        return filename
+
+    # Runs perspective transformation, circle detection and distance
+    # calculation for one image without asking the user anything
+    def processImage(self, pImageFilename: str) -> dict:
+        imageFilename = pImageFilename
+        typeOfImage = 1
+
+        # Perspective transformation is done only if its parameters are given
+        transformation = self.params.get("transformation")
+        if transformation:
+            points = np.array(transformation["coords"], dtype="float32")
+            perspective = perspective_transformation.PerspectiveTransformation(pImageFilename,
+                                                                               int(transformation["width"]),
+                                                                               int(transformation["height"]),
+                                                                               points)
+            imageFilename = self.getOutputFilename(pImageFilename, "_transformed.jpg")
+            cv2.imwrite(imageFilename, perspective.doTransformation(False))
+            typeOfImage = 2
+
+        minRadius = int(self.params["minRadius"])
+        maxRadius = int(self.params["maxRadius"])
+        objSize = int(self.params["objSize"])
+        numOfExpectedCircles = int(self.params["numOfExpectedCircles"])
+        advancedDetection = self.params.get("advancedDetection", True)
+        usePyramid = self.params.get("usePyramid", False)
+        cannyEngine = self.params.get("cannyEngine")
+        detectedFilename = self.getOutputFilename(pImageFilename, "_detected.jpg")
+
+        if self.params.get("detector", "opencv") == "opencv":
+            method = int(self.params.get("method", 1))
+            circleDetector = circle_detector_with_cv.CircleDetectorWithCV(imageFilename, minRadius, maxRadius,
+                                                                          objSize, numOfExpectedCircles,
+                                                                          typeOfImage, cannyEngine or "opencv",
+                                                                          usePyramid)
+            self.setDetectorRadii(circleDetector, minRadius, maxRadius)
+            circleDetector.headless = True
+            circleDetector.subpixelRefinement = self.params.get("subpixelRefinement", False)
+            circleDetector.corners.searchInCircles = self.params.get("cornersInCircles", False)
+            if self.params.get("priorCircles"):
+                self.setDetectorPriors(circleDetector)
+            value, img = circleDetector.findAllCircles(method, 1)
+            if value == 0 and advancedDetection:
+                value, img = circleDetector.findAllCircles(method, 0)
+        else:
+            circleDetector = circle_detector_without_cv.CircleDetectorWithoutCV(imageFilename, minRadius,
+                                                                                maxRadius, objSize,
+                                                                                numOfExpectedCircles, typeOfImage,
+                                                                                cannyEngine or "numpy", usePyramid)
+            self.setDetectorRadii(circleDetector, minRadius, maxRadius)
+            circleDetector.headless = True
+            if self.params.get("priorCircles"):
+                self.setDetectorPriors(circleDetector)
+            value, name = circleDetector.findAllCircles(1)
+            if value == 0 and advancedDetection:
+                value, name = circleDetector.findAllCircles(0)
+
+        distance = circleDetector.distance
+        result = {
+            "image": pImageFilename,
+            "typeOfImage": typeOfImage,
+            "success": value == 1,
+        }
+        result.update(distance.getResults())
+
+        with open(self.getOutputFilename(pImageFilename, ".json"), "w") as file:
+            json.dump(result, file, indent=2)
+
+        # The annotated image is drawn only on request after the numbers are written
+        if self.params.get("renderImages", False) and distance.markers:
+            self.renderDetectedImage(circleDetector, detectedFilename)
+
+        return result
+
+    # Radii of the parameter file are in pixels of the input image,
+    # the detector may work with its resized copy
+    def setDetectorRadii(self, pCircleDetector, pMinRadius: int, pMaxRadius: int):
+        pCircleDetector.minRadius = int(floor(pMinRadius * pCircleDetector.scale))
+        pCircleDetector.maxRadius = int(ceil(pMaxRadius * pCircleDetector.scale))
+
+    # Prior circles of the parameter file are in pixels of the input image too
+    def setDetectorPriors(self, pCircleDetector):
+        scale = pCircleDetector.scale
+        pCircleDetector.setPriorCircles([[x * scale, y * scale, r * scale] for x, y, r in self.params["priorCircles"]])
+
+    # Draws the measured markers and distances into the working
+    # image of the detector and saves it
+    def renderDetectedImage(self, pCircleDetector, pFilename: str):
+        distance = pCircleDetector.distance
+        if isinstance(pCircleDetector, circle_detector_with_cv.CircleDetectorWithCV):
+            cv2.imwrite(pFilename, self.renderer.renderWithCV(pCircleDetector.image, distance.markers,
+                                                              distance.distances))
+        else:
+            self.renderer.renderWithoutCV(pCircleDetector.image, distance.markers, distance.distances).save(pFilename)
+
+    # Returns the result of the image whose processing failed
+    def getFailedResult(self, pImageFilename: str, pError: str) -> dict:
+        print(Fore.RED + "\nProcessing of " + pImageFilename + " failed: " + Style.RESET_ALL + pError)
+
+        return {"image": pImageFilename, "success": False, "error": pError}
+
+    # Processes the images in one pool and stores their results. Returns the
+    # unfinished images and the images running when a worker died, an image
+    # fails once it was running during maxPoolBreaks such deaths.
+    def processImagesInPool(self, pImageFilenames: list, pWorkers: int, pTimeout: float, pResults: dict,
+                            pBreaks: dict) -> (list, list):
+        startQueue = multiprocessing.SimpleQueue()
+        executor = ProcessPoolExecutor(max_workers=pWorkers, initializer=setStartQueue, initargs=(startQueue,))
+        futures = {}
+        startTimes = {}
+        broken = []
+        resubmitted = []
+        try:
+            for name in pImageFilenames:
+                futures[executor.submit(processImageInWorker, self, name)] = name
+
+            remaining = set(futures)
+            while remaining:
+                done, remaining = wait(remaining, timeout=0.5, return_when=FIRST_COMPLETED)
+                while not startQueue.empty():
+                    startTimes[startQueue.get()] = time.monotonic()
+
+                for future in done:
+                    name = futures[future]
+                    try:
+                        pResults[name] = future.result()
+                    except BrokenProcessPool:
+                        broken.append(name)
+                    except Exception as e:
+                        pResults[name] = self.getFailedResult(name, repr(e))
+
+                now = time.monotonic()
+                timedOut = [future for future in remaining
+                            if futures[future] in startTimes and now - startTimes[futures[future]] > pTimeout]
+                if timedOut:
+                    for future in timedOut:
+                        pResults[futures[future]] = self.getFailedResult(
+                            futures[future], "Processing took more than %g seconds" % pTimeout)
+                    resubmitted = [futures[future] for future in remaining if future not in timedOut]
+                    terminateWorkers(executor)
+                    break
+        except BrokenProcessPool:
+            # The pool broke while the images were being submitted
+            broken = [name for name in pImageFilenames if name not in pResults]
+            resubmitted = []
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+        while not startQueue.empty():
+            startTimes[startQueue.get()] = time.monotonic()
+
+        # Without any finished image all broken images are suspicious
+        isFinished = any(name in pResults for name in pImageFilenames)
+        suspects = [name for name in broken if name in startTimes or not isFinished]
+        for name in suspects:
+            pBreaks[name] = pBreaks.get(name, 0) + 1
+            if pBreaks[name] >= self.maxPoolBreaks:
+                pResults[name] = self.getFailedResult(name, "Worker process died")
+
+        return (resubmitted + [name for name in broken if name not in suspects],
+                [name for name in suspects if name not in pResults])
+
+    # Processes every image in a pool of processes and writes a summary.
+    # A failed image does not stop the others, it fails also if it runs
+    # longer than the timeout ("timeout" parameter, 600 s by default).
+    def processImages(self, pPath: str, pWorkers: int = None, pTimeout: float = None) -> list:
+        imageFilenames = self.findImages(pPath)
+        self.setOutputNames(pPath, imageFilenames)
+        timeout = float(self.params.get("timeout", 600) if pTimeout is None else pTimeout)
+        print(Fore.CYAN + "\nProcessing " + Style.RESET_ALL + "%d images" % len(imageFilenames))
+
+        # Images running when a worker died are processed again one by one
+        results = {}
+        breaks = {}
+        pending, suspects = imageFilenames, []
+        while pending or suspects:
+            if suspects:
+                retried, stillSuspects = self.processImagesInPool(suspects[:1], 1, timeout, results, breaks)
+                suspects = retried + stillSuspects + suspects[1:]
+            else:
+                pending, suspects = self.processImagesInPool(pending, pWorkers, timeout, results, breaks)
+        results = [results[name] for name in imageFilenames]
+
+        with open(os.path.join(self.outputDir, "summary.json"), "w") as file:
+            json.dump(results, file, indent=2)
+
+        succeeded = sum(1 for result in results if result["success"])
+        print(Fore.YELLOW + "\nSuccessfully processed images:" + Style.RESET_ALL + " %d/%d" % (succeeded, len(results)))
+
+        return results
+
+
+# Queue to which the worker process reports the image it starts,
+# the timeout of the image is measured from that moment
+startQueue = None
+
+
+# Sets the queue of the worker process, called when the process starts
+def setStartQueue(pQueue):
+    global startQueue
+    startQueue = pQueue
+
+
+# Reports the start of the image and processes it in the worker process
+def processImageInWorker(pBatchProcessor: BatchProcessor, pImageFilename: str) -> dict:
+    startQueue.put(pImageFilename)
+
+    return pBatchProcessor.processImage(pImageFilename)
+
+
+# Stops the worker processes of the pool,
+# so a hung image does not block the others
+def terminateWorkers(pExecutor: ProcessPoolExecutor):
+    terminate = getattr(pExecutor, "terminate_workers", None)
+    if terminate is not None:
+        terminate()
+        return
+
+    for process in list(pExecutor._processes.values()):
+        process.terminate()
@@ -1,17 +1,33 @@
 from math import sqrt, atan2, pi
+from concurrent.futures import ThreadPoolExecutor
+import os
 
+from scipy.ndimage import label
 import PIL.Image
 import numpy as np
 
 
 class CannyEdgeDetector:
-    # Initialization
-    def __init__(self, pImage: PIL.Image):
+    # Initialization, the engine is "loop" (original per-pixel loops),
+    # "numpy" (whole arrays) or "tiled" (strips of the image in parallel).
+    # The number of workers defaults to the number of cores.
+    def __init__(self, pImage: PIL.Image, pEngine: str = "loop", pWorkers: int = None):
         self.image = pImage
+        self.engine = pEngine
+        self.workers = pWorkers if pWorkers else os.cpu_count() or 1
+        self.direction = None
+
+    # Canny Edge Detector algorithm cleans the image and only keeps
+    # the strongest edges, returns their (x, y) coordinates as
+    # an int32 array of shape (N, 2) sorted by x and then by y
+    def applyCannyEdgeDetector(self) -> np.ndarray:
+        if self.engine == "numpy":
+            return self.applyCannyEdgeDetectorVectorized()
+        elif self.engine == "tiled":
+            return self.applyCannyEdgeDetectorTiled()
+        elif self.engine != "loop":
+            raise ValueError("Engine %s is not supported!" % self.engine)
 
-    # Canny Edge Detector algorithm cleans the image
-    # and only keeps the strongest edges
-    def applyCannyEdgeDetector(self) -> list:
         inputPixels = self.image.load()
         width = self.image.width
         height = self.image.height
@@ -24,6 +40,7 @@ class CannyEdgeDetector:
 
         # Gradient and its direction is calculated
         gradient, direction = self.calculateGradient(blurredImg, width, height)
+        self.direction = direction
 
         # Non-maximum suppression is applicated
         self.nonMaximumSuppression(gradient, direction, width, height)
@@ -31,7 +48,12 @@ class CannyEdgeDetector:
         # Some edges, which not suited requirements are filtered out
         keepEdges = self.applyThresholdToFilterEdges(gradient, width, height, 20, 25)
 
-        return keepEdges
+        return np.array(sorted(keepEdges), dtype=np.int32).reshape(-1, 2)
+
+    # Returns gradient direction (in radians, indexed as [x, y])
+    # calculated by the last run of the detector
+    def getDirection(self) -> np.ndarray:
+        return self.direction
 
     # Transforms the image to grayscale
     def convertImageToGrayscale(self, pInputPixels, pWidth: int, pHeight: int) -> np.ndarray:
@@ -125,9 +147,187 @@ class CannyEdgeDetector:
             newkeep = set()
             for x, y in lastiter:
                 for a, b in ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)):
+                    if not (0 <= x + a < pWidth and 0 <= y + b < pHeight):
+                        continue
                     if pGradient[x + a, y + b] > pLow and (x + a, y + b) not in keep:
                         newkeep.add((x + a, y + b))
             keep.update(newkeep)
             lastiter = newkeep
 
         return list(keep)
+
+    # Same algorithm as applyCannyEdgeDetector, but every stage
+    # works on whole arrays instead of single pixels
+    def applyCannyEdgeDetectorVectorized(self) -> np.ndarray:
+
+        # Image is converted to grayscale
+        grayscaledImg = self.convertImageToGrayscaleVectorized()
+
+        # Image is blurred to remove noise
+        blurredImg = self.blurImageVectorized(grayscaledImg)
+
+        # Gradient and its direction is calculated
+        gradient, direction = self.calculateGradientVectorized(blurredImg)
+        self.direction = direction
+
+        # Non-maximum suppression is applicated
+        self.nonMaximumSuppressionVectorized(gradient, direction)
+
+        # Some edges, which not suited requirements are filtered out
+        keepEdges = self.applyThresholdToFilterEdgesVectorized(gradient, 20, 25)
+
+        return np.argwhere(keepEdges).astype(np.int32)
+
+    # Same result as applyCannyEdgeDetectorVectorized. Grayscale, blur, gradient
+    # and suppression masks run in parallel on overlapping strips. Suppression
+    # chains and hysteresis run serially on the stitched image.
+    def applyCannyEdgeDetectorTiled(self) -> np.ndarray:
+        pixels = np.asarray(self.image)[:, :, :3].transpose(1, 0, 2)
+        width = pixels.shape[0]
+
+        # Blur reaches 2 pixels, gradient and suppression masks 1 pixel each
+        halo = 4
+        bounds = np.linspace(0, width, min(self.workers, width) + 1).astype(int)
+
+        # Runs every local stage on one strip and its halo
+        # and returns only the inner part of the strip
+        def processStrip(pBounds: tuple) -> list:
+            start, stop = pBounds
+            haloStart = max(start - halo, 0)
+            haloStop = min(stop + halo, width)
+            grayscaledImg = pixels[haloStart:haloStop].sum(axis=2, dtype=np.float64) / 3
+            blurredImg = self.blurImageVectorized(grayscaledImg)
+            gradient, direction = self.calculateGradientVectorized(blurredImg)
+            masks = self.calculateSuppressionMasks(gradient, direction)
+
+            return [array[start - haloStart:stop - haloStart] for array in (gradient, direction) + masks]
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            strips = list(executor.map(processStrip, zip(bounds[:-1], bounds[1:])))
+
+        gradient, direction, suppressAlways, suppressIfEarlierKept, earlierIndex = [
+            np.concatenate(parts) for parts in zip(*strips)]
+        self.direction = direction
+
+        # Non-maximum suppression is finished on the whole image
+        suppressed = self.resolveSuppression(suppressAlways, suppressIfEarlierKept, earlierIndex)
+        gradient[suppressed] = 0
+
+        # Some edges, which not suited requirements are filtered out
+        keepEdges = self.applyThresholdToFilterEdgesVectorized(gradient, 20, 25)
+
+        return np.argwhere(keepEdges).astype(np.int32)
+
+    # Transforms the image to grayscale indexed as [x, y]
+    def convertImageToGrayscaleVectorized(self) -> np.ndarray:
+        pixels = np.asarray(self.image)[:, :, :3].transpose(1, 0, 2)
+
+        return pixels.sum(axis=2, dtype=np.float64) / 3
+
+    # Reduces noise with the Gaussian filter of blurImage
+    # applied as two passes of the kernel [1, 4, 6, 4, 1]
+    def blurImageVectorized(self, pInputPixels: np.ndarray) -> np.ndarray:
+        width, height = pInputPixels.shape
+        kernel = np.array([1, 4, 6, 4, 1])
+        offset = len(kernel) // 2
+
+        # Grayscale values are thirds of integer channel sums,
+        # so the whole convolution can be done exactly in integers
+        sums = np.rint(pInputPixels * 3).astype(np.int64)
+        padded = np.pad(sums, offset, mode="edge")
+        rows = sum(padded[a:a + width, :] * kernel[a] for a in range(len(kernel)))
+        acc = sum(rows[:, b:b + height] * kernel[b] for b in range(len(kernel)))
+        blurred = (acc // (3 * 256)).astype(np.float64)
+
+        # Where the exact result is a whole number, the float sum in blurImage
+        # can land just below it, so these pixels are summed in the same order
+        xs, ys = np.nonzero(acc % (3 * 256) == 0)
+        paddedPixels = np.pad(pInputPixels, offset, mode="edge")
+        floatAcc = 0
+        for a in range(len(kernel)):
+            for b in range(len(kernel)):
+                floatAcc += paddedPixels[xs + a, ys + b] * (kernel[a] * kernel[b] / 256)
+        blurred[xs, ys] = np.trunc(floatAcc)
+
+        return blurred
+
+    # Calculates image gradient and its direction using
+    # central differences computed on shifted slices
+    def calculateGradientVectorized(self, pInputPixels: np.ndarray) -> (np.ndarray, np.ndarray):
+        gradient = np.zeros(pInputPixels.shape)
+        direction = np.zeros(pInputPixels.shape)
+        magx = pInputPixels[2:, 1:-1] - pInputPixels[:-2, 1:-1]
+        magy = pInputPixels[1:-1, 2:] - pInputPixels[1:-1, :-2]
+        gradient[1:-1, 1:-1] = np.sqrt(magx ** 2 + magy ** 2)
+        direction[1:-1, 1:-1] = np.arctan2(magy, magx)
+
+        return gradient, direction
+
+    # Keeps only the local maxima in the direction of gradient.
+    # The loop version zeroes pixels in place, so the earlier
+    # neighbor is compared after its own suppression.
+    def nonMaximumSuppressionVectorized(self, pGradient: np.ndarray, pDirection: np.ndarray):
+        suppressAlways, suppressIfEarlierKept, earlierIndex = self.calculateSuppressionMasks(pGradient, pDirection)
+        suppressed = self.resolveSuppression(suppressAlways, suppressIfEarlierKept, earlierIndex)
+        pGradient[suppressed] = 0
+
+    # Compares every pixel with its neighbors in the direction of gradient.
+    # Returns where the later or the earlier neighbor is larger
+    # and the flat index offset of the earlier neighbor.
+    def calculateSuppressionMasks(self, pGradient: np.ndarray, pDirection: np.ndarray) -> (np.ndarray, np.ndarray,
+                                                                                           np.ndarray):
+        width, height = pGradient.shape
+        suppressAlways = np.zeros((width, height), dtype=bool)
+        suppressIfEarlierKept = np.zeros((width, height), dtype=bool)
+        earlierIndex = np.zeros((width, height), dtype=np.int64)
+        if width < 3 or height < 3:
+            return suppressAlways, suppressIfEarlierKept, earlierIndex
+
+        angle = np.where(pDirection >= 0, pDirection, pDirection + pi)
+        rangle = np.round(angle[1:-1, 1:-1] / (pi / 4)).astype(np.int64) % 4
+
+        # Offsets of the neighbors visited before and after the pixel
+        # for each of the four rounded gradient directions
+        earlierOffsets = ((-1, 0), (-1, -1), (0, -1), (-1, 1))
+        laterOffsets = ((1, 0), (1, 1), (0, 1), (1, -1))
+
+        shifted = lambda dx, dy: pGradient[1 + dx:width - 1 + dx, 1 + dy:height - 1 + dy]
+        mag = pGradient[1:-1, 1:-1]
+        earlier = np.choose(rangle, [shifted(dx, dy) for dx, dy in earlierOffsets])
+        later = np.choose(rangle, [shifted(dx, dy) for dx, dy in laterOffsets])
+
+        suppressAlways[1:-1, 1:-1] = later > mag
+        suppressIfEarlierKept[1:-1, 1:-1] = earlier > mag
+        earlierIndex[1:-1, 1:-1] = np.choose(rangle, [dx * height + dy for dx, dy in earlierOffsets])
+
+        return suppressAlways, suppressIfEarlierKept, earlierIndex
+
+    # Resolves which pixels the sequential suppression zeroes.
+    # A pixel losing only to its earlier neighbor survives
+    # if that neighbor was zeroed first.
+    def resolveSuppression(self, pSuppressAlways: np.ndarray, pSuppressIfEarlierKept: np.ndarray,
+                           pEarlierIndex: np.ndarray) -> np.ndarray:
+        suppressed = pSuppressAlways.ravel().copy()
+        resolved = pSuppressAlways.ravel() | ~pSuppressIfEarlierKept.ravel()
+        pending = np.flatnonzero(~resolved)
+        earlier = pending + pEarlierIndex.ravel()[pending]
+
+        while pending.size:
+            ready = resolved[earlier]
+            suppressed[pending[ready]] = ~suppressed[earlier[ready]]
+            resolved[pending[ready]] = True
+            pending = pending[~ready]
+            earlier = earlier[~ready]
+
+        return suppressed.reshape(pSuppressAlways.shape)
+
+    # Edge determination by thresholds on boolean masks. Weak pixels
+    # form 8-connected components, those with a strong pixel are kept.
+    def applyThresholdToFilterEdgesVectorized(self, pGradient: np.ndarray, pLow: int, pHigh: int) -> np.ndarray:
+        labels, numOfLabels = label(pGradient > pLow, structure=np.ones((3, 3), dtype=bool))
+
+        keepLabels = np.zeros(numOfLabels + 1, dtype=bool)
+        keepLabels[labels[pGradient > pHigh]] = True
+        keepLabels[0] = False
+
+        return keepLabels[labels]
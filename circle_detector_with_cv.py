@@ -2,98 +2,266 @@ import numpy
 import numpy as np
 import distance_calculator
 import corner_detector
+import circle_search
+import marker_ordering
+import canny_edge_detector
+import result_renderer
 from colorama import Fore, Style
-from operator import itemgetter
+from PIL import Image
+from math import ceil, floor
 import cv2
 
 
 class CircleDetectorWithCV:
-    # Initialization
+    # Initialization, the Canny engine is "opencv" (cv2.Canny) or one of the
+    # engines of CannyEdgeDetector. Radii and detected circles are
+    # in pixels of the working image, scale relates it to the input.
     def __init__(self, pImageFilename: str, pMinRadius: int, pMaxRadius: int, pObjSize: int, pNumOfExpectedCircles: int,
-                 pTypeOfImage: int):
+                 pTypeOfImage: int, pCannyEngine: str = "opencv", pUsePyramid: bool = False):
         self.image = cv2.imread(pImageFilename)
         self.minRadius = pMinRadius
         self.maxRadius = pMaxRadius
         self.objSize = pObjSize
         self.numOfExpectedCircles = pNumOfExpectedCircles
         self.typeOfImage = pTypeOfImage
+        self.cannyEngine = pCannyEngine
 
         dimensions = self.image.shape
 
-        # Resize input image if the image is too big
+        # Resize input image if the image is too big. Pyramid mode finds
+        # candidates in a resized copy and keeps full resolution,
+        # like the tiled engine does.
+        self.scale = 1.0
+        self.coarseScale = 1.0
+        self.coarseImage = None
         if (dimensions[1] > 1500):
-            self.image = cv2.resize(self.image, (0, 0), fx=0.5, fy=0.55)
-
-        self.imageCopy = 0
+            if pUsePyramid:
+                self.coarseScale = 0.5
+                self.coarseImage = cv2.resize(self.image, (0, 0), fx=self.coarseScale, fy=self.coarseScale)
+            elif self.cannyEngine != "tiled":
+                self.scale = 0.5
+                self.image = cv2.resize(self.image, (0, 0), fx=self.scale, fy=self.scale)
+
+        self.imageCopy = None
+        self.headless = False
+        self.renderer = result_renderer.ResultRenderer()
+        self.edgedImage = None
+        self.coarseEdgedImage = None
+        self.detectedCircles = {}
+        self.detectorCalls = 0
+        self.maxDetectorCalls = 30
+        self.priorCircles = None
+        self.priorMargin = 10
+        self.priorDetections = {}
+        self.subpixelRefinement = False
+        self.refinementTolerance = 3
         self.distance = distance_calculator.DistanceCalculator(self.objSize)
+        self.distance.scale = self.scale
         self.corners = corner_detector.CornerDetector(self.image, self.numOfExpectedCircles, self.typeOfImage)
 
-    # Uses the Hough Circle Transform
-    # to detect circles in the image
-    def detectCircles(self, pImage: np.ndarray, pMinRadius: int, pMaxRadius: int) -> np.ndarray:
-        self.imageCopy = pImage.copy()
+    # Uses the Hough Circle Transform to detect circles in the image,
+    # the advanced search does not use the prior circles as they
+    # do not depend on the searched parameters
+    def detectCircles(self, pImage: np.ndarray, pMinRadius: int, pMaxRadius: int, pParam2: int = 30,
+                      pMinDist: int = 50, pUsePriors: bool = True) -> np.ndarray:
+        if pImage is not self.image:
+            self.detectorCalls += 1
+            return self.findCircles(self.detectEdges(pImage), pMinRadius, pMaxRadius, pParam2, pMinDist)
+
+        # Markers found around their previous positions
+        # make the search of the whole image unnecessary
+        if pUsePriors and self.priorCircles is not None:
+            if pParam2 not in self.priorDetections:
+                self.priorDetections[pParam2] = self.detectCirclesAroundPriors(pParam2)
+            if self.priorDetections[pParam2] is not None:
+                return self.priorDetections[pParam2]
+
+        # Edges of the working image and circles
+        # of each set of parameters are cached
+        key = (pMinRadius, pMaxRadius, pParam2, pMinDist)
+        if key not in self.detectedCircles:
+            if self.coarseImage is not None:
+                self.detectedCircles[key] = self.detectCirclesPyramid(pMinRadius, pMaxRadius, pParam2, pMinDist)
+            else:
+                if self.edgedImage is None:
+                    self.edgedImage = self.detectEdges(pImage)
+                self.detectorCalls += 1
+                self.detectedCircles[key] = self.findCircles(self.edgedImage, pMinRadius, pMaxRadius, pParam2,
+                                                             pMinDist)
+
+        return self.detectedCircles[key]
+
+    # Sets circles (x, y, r) detected in the previous image of the effector.
+    # Following detections search only in windows around them.
+    def setPriorCircles(self, pCircles: list, pMargin: int = 10):
+        self.priorCircles = pCircles
+        self.priorMargin = pMargin
+        self.priorDetections = {}
+
+    # Detects every circle in the window around its previous position,
+    # returns None if any of them was not found
+    def detectCirclesAroundPriors(self, pParam2: int) -> np.ndarray:
+        circles = []
+        for x, y, r in self.priorCircles:
+            minRadius, maxRadius = circle_search.getRadiusWindow(r, self.priorMargin)
+            circle = self.detectCircleInWindow(x, y, minRadius, maxRadius, self.priorMargin, pParam2)
+            if circle is None:
+                print(Fore.YELLOW + "Circle was not found around its previous position, searching whole image."
+                      + Style.RESET_ALL)
+                return None
+            circles.append(circle)
+
+        return np.array([circles], dtype=np.float32)
+
+    # Finds candidate circles in the smaller image and refines each
+    # of them in a window of the full resolution image
+    def detectCirclesPyramid(self, pMinRadius: int, pMaxRadius: int, pParam2: int, pMinDist: int) -> np.ndarray:
+        if self.coarseEdgedImage is None:
+            self.coarseEdgedImage = self.detectEdges(self.coarseImage)
+
+        self.detectorCalls += 1
+        candidates = self.findCircles(self.coarseEdgedImage, int(floor(pMinRadius * self.coarseScale)),
+                                      int(ceil(pMaxRadius * self.coarseScale)), pParam2,
+                                      max(int(pMinDist * self.coarseScale), 1))
+        if candidates is None:
+            return None
+
+        # One pixel of the smaller image covers this many pixels of the full one.
+        # Hough Circle Transform needs a radius interval which is not too narrow.
+        margin = int(ceil(1 / self.coarseScale)) + 1
+        circles = []
+        for x, y, r in candidates[0] / self.coarseScale:
+            tolerance = max(margin, int(r * 0.1))
+            circle = self.detectCircleInWindow(x, y, int(r) - tolerance, int(r) + tolerance + 1, tolerance, pParam2)
+            circles.append(circle if circle is not None else np.array([x, y, r]))
+
+        return np.array([circles], dtype=np.float32)
+
+    # Searches for the circle closest to the expected center in the window
+    # around it. Returns it in coordinates of the whole image or None.
+    def detectCircleInWindow(self, pCenterX: float, pCenterY: float, pMinRadius: int, pMaxRadius: int, pMargin: int,
+                             pParam2: int = 30) -> np.ndarray:
+        height, width = self.image.shape[:2]
+        reach = pMaxRadius + pMargin
+        x0 = max(int(pCenterX) - reach, 0)
+        y0 = max(int(pCenterY) - reach, 0)
+        x1 = min(int(pCenterX) + reach + 1, width)
+        y1 = min(int(pCenterY) + reach + 1, height)
+        if x1 <= x0 or y1 <= y0:
+            return None
+
+        self.detectorCalls += 1
+        circles = self.findCircles(self.detectEdges(self.image[y0:y1, x0:x1]), max(pMinRadius, 1),
+                                   max(pMaxRadius, 1), pParam2, 2 * reach)
+        if circles is None:
+            return None
+
+        circles = circles[0] + np.array([x0, y0, 0], dtype=np.float32)
+        distances = (circles[:, 0] - pCenterX) ** 2 + (circles[:, 1] - pCenterY) ** 2
+
+        return circles[np.argmin(distances)]
+
+    # Prepares the image for Hough Circle Transform
+    # by keeping only its edges
+    def detectEdges(self, pImage: np.ndarray) -> np.ndarray:
         pImage = cv2.cvtColor(pImage, cv2.COLOR_BGR2RGB)
         pImage = cv2.cvtColor(pImage, cv2.COLOR_BGR2GRAY)
         pImage = cv2.medianBlur(pImage, 5)
 
         # Application of Canny Edge Detection algorithm
-        edgedImage = cv2.Canny(pImage, 50, 100)
+        if self.cannyEngine == "opencv":
+            edgedImage = cv2.Canny(pImage, 50, 100)
+        else:
+            edgedImage = self.detectEdgesWithoutCV(pImage)
         edgedImage = cv2.dilate(edgedImage, None, iterations=1)
         edgedImage = cv2.erode(edgedImage, None, iterations=1)
 
-        circles = cv2.HoughCircles(image=edgedImage, method=cv2.HOUGH_GRADIENT, dp=1,
-                                   minDist=50, param1=100, param2=30, minRadius=pMinRadius,
+        return edgedImage
+
+    # Runs CannyEdgeDetector on the blurred grayscale image
+    # and returns its edges as an image like cv2.Canny does
+    def detectEdgesWithoutCV(self, pImage: np.ndarray) -> np.ndarray:
+        canny = canny_edge_detector.CannyEdgeDetector(Image.fromarray(pImage).convert("RGB"), self.cannyEngine)
+        edges = canny.applyCannyEdgeDetector()
+        edgedImage = np.zeros(pImage.shape[:2], dtype=np.uint8)
+        edgedImage[edges[:, 1], edges[:, 0]] = 255
+
+        return edgedImage
+
+    # Finds circles with radius from the given interval in the edged image.
+    # Param2 is the accumulator threshold and minDist the smallest
+    # distance between two centers.
+    def findCircles(self, pEdgedImage: np.ndarray, pMinRadius: int, pMaxRadius: int, pParam2: int,
+                    pMinDist: int) -> np.ndarray:
+        circles = cv2.HoughCircles(image=pEdgedImage, method=cv2.HOUGH_GRADIENT, dp=1,
+                                   minDist=pMinDist, param1=100, param2=pParam2, minRadius=pMinRadius,
                                    maxRadius=pMaxRadius)
 
         return circles
 
-    # Compares coordinates of two detected circles
-    def cmp(self, pCoord1: np.ndarray, pCoord2: np.ndarray) -> (np.ndarray, np.ndarray):
-        marker1 = None
-        marker2 = None
-        if pCoord1[0] >= pCoord2[0] and pCoord1[1] <= pCoord2[1]:
-            marker1 = pCoord1
-            marker2 = pCoord2
-        else:
-            marker1 = pCoord2
-            marker2 = pCoord1
-
-        return marker1, marker2
+    # Searches for the radius window, param2 and minDist with which the
+    # expected number of circles is detected. Returns the best circles
+    # found and how many detector calls were spent.
+    def searchParameters(self, pMaxCalls: int) -> (np.ndarray, int):
+        search = circle_search.ParameterSearch(
+            lambda p: self.detectCircles(self.image, max(p[0], 0), p[1], p[2], p[3], False),
+            lambda circles: 0 if circles is None else int(circles.shape[1]), self.numOfExpectedCircles, pMaxCalls)
+        search.searchRadiusWindow(lambda i: (self.minRadius - i, self.maxRadius + i, 30, 50), self.minRadius,
+                                  self.maxRadius)
+
+        # Lower accumulator threshold finds more circles
+        minRadius, maxRadius, param2, minDist = search.params
+        search.bisect(lambda v: (minRadius, maxRadius, -v, minDist), -100, -5)
+
+        # Smaller distance between centers finds more circles
+        minRadius, maxRadius, param2, minDist = search.params
+        search.bisect(lambda v: (minRadius, maxRadius, param2, -v), -4 * max(maxRadius, 1), -1)
+
+        return search.circles, search.calls
+
+    # Fits a circle by least squares to the window edges near the detected one.
+    # The fit is repeated once with the edges near the fitted circle.
+    def refineCircle(self, pCircle: np.ndarray) -> np.ndarray:
+        x, y, r = (float(value) for value in pCircle[:3])
+        reach = int(ceil(r)) + 2 * self.refinementTolerance
+        height, width = self.image.shape[:2]
+        x0, y0 = max(int(x) - reach, 0), max(int(y) - reach, 0)
+        x1, y1 = min(int(x) + reach + 1, width), min(int(y) + reach + 1, height)
+        if x1 <= x0 or y1 <= y0:
+            return np.array([x, y, r])
+
+        window = cv2.cvtColor(self.image[y0:y1, x0:x1], cv2.COLOR_BGR2GRAY)
+        window = cv2.medianBlur(window, 5)
+        ys, xs = np.nonzero(cv2.Canny(window, 50, 100))
+        xs = xs + float(x0)
+        ys = ys + float(y0)
+
+        for _ in range(2):
+            isClose = np.abs(np.hypot(xs - x, ys - y) - r) <= self.refinementTolerance
+            if isClose.sum() < 8:
+                break
+
+            # x^2 + y^2 = 2 * a * x + 2 * b * y + c, where c = r^2 - a^2 - b^2
+            px, py = xs[isClose], ys[isClose]
+            matrix = np.column_stack((2 * px, 2 * py, np.ones(len(px))))
+            (a, b, c), *_ = np.linalg.lstsq(matrix, px ** 2 + py ** 2, rcond=None)
+            if c + a ** 2 + b ** 2 <= 0:
+                break
+            x, y, r = a, b, np.sqrt(c + a ** 2 + b ** 2)
+
+        return np.array([x, y, r])
+
+    # Refines every detected circle in its own window
+    def refineCircles(self, pCircles: np.ndarray) -> np.ndarray:
+        return np.array([self.refineCircle(circle) for circle in pCircles]).reshape(-1, 3)
 
     # Sorts circles according to anchor positions
     # (anchors A, B and C) in the image
-    def sortCircles(self, pListOfCircles: np.ndarray, pTypeOfImage: int) -> np.ndarray:
-        markersOrder = []
-        auxList = sorted(pListOfCircles[0], key=itemgetter(1), reverse=True)
-        if pTypeOfImage == 1:
-            markersOrder.append(auxList[3])
-            marker1, marker2 = self.cmp(auxList[2], auxList[1])
-            markersOrder.append(marker1)
-            marker2, marker5 = self.cmp(auxList[5], marker2)
-            markersOrder.append(marker2)
-            markersOrder.append(auxList[6])
-            markersOrder.append(auxList[4])
-            markersOrder.append(marker5)
-            markersOrder.append(auxList[0])
-        else:
-            #marker0, marker5 = self.cmp(auxList[3], auxList[4])
-            #markersOrder.append(marker5)
-
-            markersOrder.append(auxList[3])
-
-            markersOrder.append(auxList[1])
-            markersOrder.append(auxList[2])
-            markersOrder.append(auxList[5])
-            markersOrder.append(auxList[6])
-            #markersOrder.append(marker0)
-
-            markersOrder.append(auxList[4])
-
-            markersOrder.append(auxList[0])
-
-        sortedList = np.array(markersOrder)
+    def sortCircles(self, pListOfCircles: np.ndarray) -> np.ndarray:
+        circles = pListOfCircles.reshape(-1, pListOfCircles.shape[-1])
 
-        return sortedList
+        return circles[marker_ordering.orderMarkers(circles[:, 0], circles[:, 1],
+                                                     marker_ordering.hasNozzle(self.numOfExpectedCircles))]
 
     # Finds circles in the image according to input parameters
     # using Hough Circle Transform method and calculates
@@ -104,20 +272,9 @@ class CircleDetectorWithCV:
         # If the previous detection was not complete or reliable
         # then the extended detection of circles starts
         if pWasSuccess == 0:
-            numOfCircles = 0
-            i = 0
-            while numOfCircles != self.numOfExpectedCircles:
-                if numOfCircles < self.numOfExpectedCircles:
-                    listOfCircles = self.detectCircles(self.image, self.minRadius - i, self.maxRadius + i)
-                elif numOfCircles > self.numOfExpectedCircles:
-                    listOfCircles = self.detectCircles(self.image, self.minRadius + i, self.maxRadius - i)
-                else:
-                    listOfCircles = self.detectCircles(self.image, self.minRadius, self.maxRadius)
-
-                if listOfCircles is not None:
-                    numOfCircles = int(sum(map(len, listOfCircles)))
-
-                i += 1
+            listOfCircles, calls = self.searchParameters(self.maxDetectorCalls)
+            print(Fore.YELLOW + "Advanced detection used " + Style.RESET_ALL + str(calls) + Fore.YELLOW +
+                  " detector calls" + Style.RESET_ALL)
         else:
             listOfCircles = self.detectCircles(self.image, self.minRadius, self.maxRadius)
 
@@ -128,68 +285,57 @@ class CircleDetectorWithCV:
         # If some of the required circles have been
         # found, their processing continues
         if listOfCircles is not None:
-            aux = None
-
-            # If the counts of detected circles and expected circles
-            # are same, then sorts circles to the correct order
-            # according to anchors positions
-            if int(sum(map(len, listOfCircles))) == self.numOfExpectedCircles:
-                sortedListOfCircles = self.sortCircles(listOfCircles, self.typeOfImage)
-                listOfCircles = sortedListOfCircles
-                aux = listOfCircles[:]
-            else:
-                aux = listOfCircles[0, :]
 
-            # Extracts coordinates and radii from the detected
-            # circles and draws the circles in the image
+            # Sorts circles to the correct order according to anchors positions
+            aux = self.sortCircles(listOfCircles)
+
+            # Centers and radii keep sub-pixel precision of the fitted circles
+            if self.subpixelRefinement:
+                aux = self.refineCircles(aux)
+
+            # Extracts coordinates and radii from the detected circles
             for co, i in enumerate(aux, start=1):
-                if pOption == 1:
-                    cv2.putText(self.imageCopy, "{:d}.".format(co - 1), (int(i[0] + 20), int(i[1] + 20)),
-                                cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 0), 2)
-                    cv2.circle(self.imageCopy, (int(i[0]), int(i[1])), int(i[2]), (0, 255, 0), 2)
-                    cv2.circle(self.imageCopy, (int(i[0]), int(i[1])), 2, (0, 0, 255), 3)
-                listOfCoordsX.append(int(i[0]))
-                listOfCoordsY.append(int(i[1]))
-                listOfRadii.append(int(i[2]))
+                if self.subpixelRefinement:
+                    listOfCoordsX.append(float(i[0]))
+                    listOfCoordsY.append(float(i[1]))
+                    listOfRadii.append(float(i[2]))
+                else:
+                    listOfCoordsX.append(int(i[0]))
+                    listOfCoordsY.append(int(i[1]))
+                    listOfRadii.append(int(i[2]))
                 print(co, "X:", i[0], "| Y:", i[1], "| R:", i[2])
 
             numOfCircles = int(sum(map(len, listOfCircles)))
 
-            # Based on the method chosen by the user,
-            # determines if the required number of circles
-            # has been detected or not, calculates distances
-            # between them and returns the image
-            if pOption == 1:
-                if numOfCircles < self.numOfExpectedCircles:
-                    print(Fore.RED + "\nThe required number of circles was not detected!")
-                    print(
-                        Fore.YELLOW + "Try changing interval between the smallest and largest radii you are looking for.")
-                    print(Style.RESET_ALL)
-                    return 0, self.distance.findAllDistances(listOfCoordsX, listOfCoordsY, listOfRadii, self.imageCopy,
-                                                             1)
-                else:
-                    return 1, self.distance.findAllDistances(listOfCoordsX, listOfCoordsY, listOfRadii, self.imageCopy,
-                                                             1)
-            elif pOption == 2:
-                list1, list2 = self.corners.findMidpointsOfCircles(listOfCoordsX, listOfCoordsY, listOfRadii)
-                print(list1)
-                for i in range(len(list1)):
-                    cv2.putText(self.imageCopy, "{:d}.".format(i), (int(list1[i] + 20), int(list2[i] + 20)),
-                                cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 0), 2)
-                    cv2.circle(self.imageCopy, (int(list1[i]), int(list2[i])),
-                               int(listOfRadii[i]), (0, 255, 0), 2)
-                    cv2.circle(self.imageCopy, (int(list1[i]), int(list2[i])), 2, (255, 0, 0), 3)
-
-                listOfRadii.reverse()
-
-                if numOfCircles < self.numOfExpectedCircles:
-                    print(Fore.RED + "\nThe required number of circles was not detected!")
-                    print(
-                        Fore.YELLOW + "Try changing interval between the smallest and largest radii you are looking for.")
-                    print(Style.RESET_ALL)
-                    return 0, self.distance.findAllDistances(list1, list2, listOfRadii, self.imageCopy, 1)
-                else:
-                    return 1, self.distance.findAllDistances(list1, list2, listOfRadii, self.imageCopy, 1)
+            # Based on the method chosen by the user, new midpoints
+            # of circles are defined by the corners of the markers
+            centerColor = (0, 0, 255)
+            if pOption == 2:
+                listOfCoordsX, listOfCoordsY, listOfRadii = self.corners.findMidpointsOfCircles(listOfCoordsX,
+                                                                                              listOfCoordsY,
+                                                                                              listOfRadii)
+                print(listOfCoordsX)
+                centerColor = (255, 0, 0)
+
+            # Calculates distances between the circles and prints them.
+            # The result file and the annotated image are skipped in headless mode.
+            self.distance.findAllDistances(listOfCoordsX, listOfCoordsY, listOfRadii)
+            self.distance.printDistances()
+            self.imageCopy = None
+            if not self.headless:
+                self.distance.writeResults(self.distance.resultFilename)
+                self.imageCopy = self.renderer.renderWithCV(self.image, self.distance.markers,
+                                                            self.distance.distances, centerColor)
+
+            # Determines if the required number of circles has been
+            # detected or not and returns the annotated image
+            if numOfCircles < self.numOfExpectedCircles:
+                print(Fore.RED + "\nThe required number of circles was not detected!")
+                print(Fore.YELLOW + "Try changing interval between the smallest and largest radii you are looking for.")
+                print(Style.RESET_ALL)
+                return 0, self.imageCopy
+            else:
+                return 1, self.imageCopy
         else:
 
             # If no circles were detected, returns original image
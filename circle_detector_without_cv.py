@@ -1,15 +1,42 @@
-from PIL import Image, ImageDraw
-from math import sqrt, pi, cos, sin
+from PIL import Image
+from math import pi, cos, sin, ceil, floor
 from colorama import Fore, Style
+from scipy.ndimage import maximum_filter
 import canny_edge_detector
 import distance_calculator
-from collections import defaultdict
-from operator import itemgetter
+import circle_search
+import marker_ordering
+import result_renderer
+import numpy as np
+from collections import OrderedDict
+from functools import lru_cache
+
+
+# Returns unique circle offsets of the radius with their counts and the
+# offset of every angle step. Tables are shared and read-only.
+@lru_cache(maxsize=1024)
+def getOffsetTable(pRadius: int, pSteps: int) -> tuple:
+    points = np.array([(int(pRadius * cos(2 * pi * t / pSteps)), int(pRadius * sin(2 * pi * t / pSteps)))
+                       for t in range(pSteps)], dtype=np.int64).reshape(-1, 2)
+    offsets, stepIndex, counts = np.unique(points, axis=0, return_inverse=True, return_counts=True)
+    stepIndex = stepIndex.reshape(-1)
+    for table in (offsets, counts, stepIndex):
+        table.setflags(write=False)
+
+    return offsets, counts, stepIndex
+
+
+# Returns cached offset tables of every radius of the window
+def getOffsetTables(pMinRadius: int, pMaxRadius: int, pSteps: int) -> dict:
+    return {r: getOffsetTable(r, pSteps) for r in range(pMinRadius, pMaxRadius + 1)}
 
 
 class CircleDetectorWithoutCV:
-    # Initialization
-    def __init__(self, pImageFilename: str, pMinRadius: int, pMaxRadius: int, pObjSize: int, pNumOfExpectedCircles: int, pTypeOfImage: int):
+    # Initialization, the Canny engine is one of the engines of CannyEdgeDetector.
+    # Radii and detected circles are in pixels of the working image,
+    # scale relates it to the input image.
+    def __init__(self, pImageFilename: str, pMinRadius: int, pMaxRadius: int, pObjSize: int, pNumOfExpectedCircles: int, pTypeOfImage: int,
+                 pCannyEngine: str = "numpy", pUsePyramid: bool = False):
         self.image = Image.open(pImageFilename)
         self.filename = pImageFilename
         self.minRadius = pMinRadius
@@ -17,92 +44,306 @@ class CircleDetectorWithoutCV:
         self.objSize = pObjSize
         self.numOfExpectedCircles = pNumOfExpectedCircles
         self.typeOfImage = pTypeOfImage
+        self.cannyEngine = pCannyEngine
 
-        # Resize input image if the image is too big
+        # Resize input image if the image is too big. Pyramid mode finds
+        # candidates with a detector of the resized image and keeps
+        # full resolution, like the tiled engine does.
+        self.scale = 1.0
+        self.coarseDetector = None
         if (self.image.size[0] > 1500):
-            newWidth = int(self.image.size[0] / 2)
-            newHeight = int(self.image.size[1] / 2)
-            self.image = self.image.resize((newWidth, newHeight))
+            if pUsePyramid:
+                self.coarseDetector = CircleDetectorWithoutCV(pImageFilename, pMinRadius, pMaxRadius, pObjSize,
+                                                              pNumOfExpectedCircles, pTypeOfImage)
+            elif self.cannyEngine != "tiled":
+                newWidth = int(self.image.size[0] / 2)
+                newHeight = int(self.image.size[1] / 2)
+                self.image = self.image.resize((newWidth, newHeight))
+                self.scale = 0.5
+
+        self.outputFilename = ""
+        if self.typeOfImage == 1:
+            self.outputFilename = "output_images/detectedCirclesOriginal_withoutOpenCV.jpg"
+        elif self.typeOfImage == 2:
+            self.outputFilename = "output_images/detectedCirclesTransformed_withoutOpenCV.jpg"
 
-        self.outputImage = Image.new("RGB", self.image.size)
-        self.outputImage.paste(self.image)
-        self.drawResult = ImageDraw.Draw(self.outputImage)
+        self.outputImage = None
+        self.headless = False
+        self.renderer = result_renderer.ResultRenderer()
         self.steps = 100
         self.threshold = 0.4
-        self.canny = canny_edge_detector.CannyEdgeDetector(self.image)
+        self.maxDetectorCalls = 30
+        self.canny = canny_edge_detector.CannyEdgeDetector(self.image, self.cannyEngine)
+        self.edges = None
+        self.radiusLayers = OrderedDict()
+        self.maxRadiusLayers = 64
+        self.votingMode = "full"
+        self.angularTolerance = pi / 8
+        self.gradientSteps = None
+        self.priorCircles = None
+        self.priorMargin = 10
+        self.priorDetections = {}
         self.distance = distance_calculator.DistanceCalculator(self.objSize)
+        self.distance.scale = self.scale
+
+    # Sets how edge pixels vote. In "full" mode they vote for the whole circle,
+    # in "gradient" mode only along their gradient direction (both ways)
+    # within the angular tolerance, which has to be smaller than pi / 2.
+    def setVotingMode(self, pVotingMode: str, pAngularTolerance: float = pi / 8):
+        if pVotingMode not in ("full", "gradient"):
+            raise ValueError("Voting mode %s is not supported!" % pVotingMode)
+
+        self.votingMode = pVotingMode
+        self.angularTolerance = pAngularTolerance
+        self.radiusLayers.clear()
+        self.gradientSteps = None
 
     # Detects circles in the image based on the minimum and maximum
     # radius, where the threshold represents the threshold value
     # from which we can consider the circle as trustworthy and
     # meet the specified criteria
-    def detectCircles(self, pMinRadius: int, pMaxRadius: int, pThreshold: float) -> list:
-        points = []
+    def detectCircles(self, pMinRadius: int, pMaxRadius: int, pThreshold: float, pUsePriors: bool = True) -> list:
+
+        # Markers found around their previous positions make the search of
+        # the whole image unnecessary. Advanced search does not use them.
+        if pUsePriors and self.priorCircles is not None:
+            if pThreshold not in self.priorDetections:
+                self.priorDetections[pThreshold] = self.detectCirclesAroundPriors(pThreshold)
+            if self.priorDetections[pThreshold] is not None:
+                return self.priorDetections[pThreshold]
+
+        if self.coarseDetector is not None:
+            circles = self.detectCirclesPyramid(pMinRadius, pMaxRadius, pThreshold)
+            print(circles)
+            return circles
+
+        # Executes Canny Edge Detector algorithm only once
+        if self.edges is None:
+            self.edges = self.canny.applyCannyEdgeDetector()
+
+        # Only circles fitting into the image are searched
+        pMinRadius, pMaxRadius = max(pMinRadius, 1), min(pMaxRadius, min(self.image.size) // 2)
+        if pMinRadius > pMaxRadius or not len(self.edges):
+            print([])
+            return []
+
+        # Executes Hough Circle Transform method, votes are cast
+        # only for the radii which have no layer yet
+        offsetTables = getOffsetTables(pMinRadius, pMaxRadius, self.steps)
         for r in range(pMinRadius, pMaxRadius + 1):
-            for t in range(self.steps):
-                points.append((r, int(r * cos(2 * pi * t / self.steps)), int(r * sin(2 * pi * t / self.steps))))
-
-        # Executes Canny Edge Detector algorithm
-        acc = defaultdict(int)
-        for x, y in self.canny.applyCannyEdgeDetector():
-            for r, dx, dy in points:
-                a = x - dx
-                b = y - dy
-                acc[(a, b, r)] += 1
-
-        # Executes Hough Circle Transform method
-        circles = []
-        for k, v in sorted(acc.items(), key=lambda i: -i[1]):
-            x, y, r = k
-            if v / self.steps >= pThreshold and all((x - xc) ** 2 + (y - yc) ** 2 > rc ** 2 for xc, yc, rc in circles):
-                print(v / self.steps, x, y, r)
-                circles.append((x, y, r))
+            if r in self.radiusLayers:
+                self.radiusLayers.move_to_end(r)
+            else:
+                self.radiusLayers[r] = self.voteForRadius(r, offsetTables[r])
+
+        # Least recently used layers outside the window are dropped
+        while len(self.radiusLayers) > max(self.maxRadiusLayers, pMaxRadius - pMinRadius + 1):
+            self.radiusLayers.popitem(last=False)
+
+        circles = self.findPeaks(pMinRadius, pMaxRadius, pThreshold)
 
         print(circles)
 
         return circles
 
-    # Compares coordinates of two detected circles
-    def cmp(self, pCoord1: tuple, pCoord2: tuple) -> (tuple, tuple):
-        marker1 = None
-        marker2 = None
-        if pCoord1[0] >= pCoord2[0] and pCoord1[1] <= pCoord2[1]:
-            marker1 = pCoord1
-            marker2 = pCoord2
+    # Sets circles (x, y, r) detected in the previous image of the effector.
+    # Following detections search only in windows around them.
+    def setPriorCircles(self, pCircles: list, pMargin: int = 10):
+        self.priorCircles = pCircles
+        self.priorMargin = pMargin
+        self.priorDetections = {}
+
+    # Detects every circle in the window around its previous position,
+    # returns None if any of them was not found
+    def detectCirclesAroundPriors(self, pThreshold: float) -> list:
+        circles = []
+        for x, y, r in self.priorCircles:
+            minRadius, maxRadius = circle_search.getRadiusWindow(r, self.priorMargin)
+            circle = self.detectCircleInWindow(x, y, minRadius, maxRadius, self.priorMargin, pThreshold)
+            if circle is None:
+                print(Fore.YELLOW + "Circle was not found around its previous position, searching whole image."
+                      + Style.RESET_ALL)
+                return None
+            circles.append(circle)
+
+        return circles
+
+    # Finds candidate circles in the resized image and refines each
+    # of them in a window of the full resolution image
+    def detectCirclesPyramid(self, pMinRadius: int, pMaxRadius: int, pThreshold: float) -> list:
+        coarseScale = self.coarseDetector.scale
+        candidates = self.coarseDetector.detectCircles(int(floor(pMinRadius * coarseScale)),
+                                                       int(ceil(pMaxRadius * coarseScale)), pThreshold)
+
+        # One pixel of the resized image covers this many pixels of the full one.
+        # Candidates already passed the threshold, so windows only locate them.
+        margin = int(ceil(1 / coarseScale)) + 1
+        circles = []
+        for x, y, r in candidates:
+            x, y, r = x / coarseScale, y / coarseScale, r / coarseScale
+            circle = self.detectCircleInWindow(x, y, int(r) - margin, int(r) + margin + 1, margin, 0)
+            circles.append(circle if circle is not None else (int(x), int(y), int(r)))
+
+        return circles
+
+    # Searches for the most voted circle in the window around the expected
+    # center. Returns it in coordinates of the whole image or None.
+    def detectCircleInWindow(self, pCenterX: float, pCenterY: float, pMinRadius: int, pMaxRadius: int, pMargin: int,
+                             pThreshold: float) -> tuple:
+        width, height = self.image.size
+        reach = pMaxRadius + pMargin
+        x0 = max(int(pCenterX) - reach, 0)
+        y0 = max(int(pCenterY) - reach, 0)
+        x1 = min(int(pCenterX) + reach + 1, width)
+        y1 = min(int(pCenterY) + reach + 1, height)
+        if x1 <= x0 or y1 <= y0:
+            return None
+
+        window = self.image.crop((x0, y0, x1, y1))
+        edges = canny_edge_detector.CannyEdgeDetector(window, self.cannyEngine).applyCannyEdgeDetector()
+        windowWidth, windowHeight = window.size
+
+        best = None
+        offsetTables = getOffsetTables(max(pMinRadius, 1), pMaxRadius, self.steps)
+        for r in range(max(pMinRadius, 1), pMaxRadius + 1):
+            offsets, counts, _ = offsetTables[r]
+            a = edges[:, 0, None] - offsets[None, :, 0]
+            b = edges[:, 1, None] - offsets[None, :, 1]
+            weights = np.broadcast_to(counts[None, :], a.shape)
+            inside = (a >= 0) & (a < windowWidth) & (b >= 0) & (b < windowHeight)
+            votes = np.bincount((a * windowHeight + b)[inside], weights[inside],
+                                minlength=windowWidth * windowHeight).astype(np.int64)
+            i = int(np.argmax(votes))
+            if best is None or votes[i] > best[0]:
+                best = (int(votes[i]), i // windowHeight + x0, i % windowHeight + y0, r)
+
+        if best is None or best[0] == 0 or best[0] / self.steps < pThreshold:
+            return None
+
+        return best[1], best[2], best[3]
+
+    # Every edge pixel votes for all centers at the given radius from it.
+    # Repeated offsets of the circle are cast once with their count.
+    # Keeps the 3x3 maximum of the padded layer and its local maxima.
+    def voteForRadius(self, pRadius: int, pOffsetTable: tuple) -> (np.ndarray, np.ndarray, np.ndarray, np.ndarray):
+        offsets, counts, stepIndex = pOffsetTable
+
+        width, height = self.image.size
+        padding = abs(pRadius)
+        paddedWidth = width + 2 * padding
+        paddedHeight = height + 2 * padding
+
+        # A center gets at most one vote per angle step
+        if self.votingMode == "gradient":
+            edgeIndex, steps = self.findGradientSteps()
+            a = self.edges[edgeIndex, 0] - offsets[stepIndex[steps], 0] + padding
+            b = self.edges[edgeIndex, 1] - offsets[stepIndex[steps], 1] + padding
+            votes = np.bincount(a * paddedHeight + b, minlength=paddedWidth * paddedHeight)
         else:
-            marker1 = pCoord2
-            marker2 = pCoord1
+            a = self.edges[:, 0, None] - offsets[None, :, 0] + padding
+            b = self.edges[:, 1, None] - offsets[None, :, 1] + padding
+            weights = np.broadcast_to(counts[None, :], a.shape)
+            votes = np.bincount((a * paddedHeight + b).ravel(), weights.ravel(), minlength=paddedWidth * paddedHeight)
+        layer = votes.reshape(paddedWidth, paddedHeight).astype(np.min_scalar_type(self.steps))
+
+        layerMaximum = maximum_filter(layer, size=3)
+        xs, ys = np.nonzero((layer == layerMaximum) & (layer > 0))
+        votes = layer[xs, ys].astype(np.int64)
+        order = np.argsort(-votes, kind="stable")
+
+        return layerMaximum, xs[order] - padding, ys[order] - padding, votes[order]
+
+    # Finds pairs of edge pixels and angle steps within the angular tolerance
+    # of the gradient direction or of its opposite. The pairs do not
+    # depend on the radius, so they are found only once.
+    def findGradientSteps(self) -> (np.ndarray, np.ndarray):
+        if self.gradientSteps is not None:
+            return self.gradientSteps
+
+        stepAngle = 2 * pi / self.steps
+        reach = int(self.angularTolerance // stepAngle) + 1
+        shifts = np.arange(-reach, reach + 1)
+        direction = self.canny.getDirection()[self.edges[:, 0], self.edges[:, 1]]
+
+        # Nearest steps around the gradient direction and around the opposite one
+        steps = np.concatenate([np.rint(angle / stepAngle).astype(np.int64)[:, None] + shifts[None, :]
+                                for angle in (direction, direction + pi)], axis=1)
+        difference = np.remainder(steps * stepAngle - direction[:, None], pi)
+        isInside = np.minimum(difference, pi - difference) <= self.angularTolerance
+
+        edgeIndex = np.broadcast_to(np.arange(len(self.edges))[:, None], steps.shape)[isInside]
+        self.gradientSteps = edgeIndex, np.remainder(steps[isInside], self.steps)
+
+        return self.gradientSteps
+
+    # Returns the 3x3 maximum of the votes of the given radius layer
+    # around the centers (zero outside the layer)
+    def layerMaximumAt(self, pRadius: int, pXs: np.ndarray, pYs: np.ndarray) -> np.ndarray:
+        layerMaximum = self.radiusLayers[pRadius][0]
+        xs = pXs + abs(pRadius)
+        ys = pYs + abs(pRadius)
+        inside = (xs >= 0) & (xs < layerMaximum.shape[0]) & (ys >= 0) & (ys < layerMaximum.shape[1])
+        values = np.zeros(len(xs), dtype=np.int64)
+        values[inside] = layerMaximum[xs[inside], ys[inside]]
+
+        return values
+
+    # Keeps 3x3x3 local maxima of the window above the threshold.
+    # From the most voted one, accepts circles whose centers
+    # do not lie inside an accepted circle.
+    def findPeaks(self, pMinRadius: int, pMaxRadius: int, pThreshold: float) -> list:
 
-        return marker1, marker2
+        # The smallest number of votes satisfying votes / steps >= threshold
+        minVotes = max(int(ceil(pThreshold * self.steps)), 1)
+        while minVotes > 1 and (minVotes - 1) / self.steps >= pThreshold:
+            minVotes -= 1
+        while minVotes / self.steps < pThreshold:
+            minVotes += 1
+
+        candidates = []
+        for r in range(pMinRadius, pMaxRadius + 1):
+            layerMaximum, xs, ys, votes = self.radiusLayers[r]
+            count = np.searchsorted(-votes, -minVotes, side="right")
+            xs, ys, votes = xs[:count], ys[:count], votes[:count]
+            isPeak = np.ones(count, dtype=bool)
+            for neighbour in (r - 1, r + 1):
+                if pMinRadius <= neighbour <= pMaxRadius:
+                    isPeak &= votes >= self.layerMaximumAt(neighbour, xs, ys)
+            candidates.append(np.stack((votes[isPeak], xs[isPeak], ys[isPeak], np.full(isPeak.sum(), r))))
+
+        candidates = np.concatenate(candidates, axis=1)
+        candidates = candidates[:, np.argsort(-candidates[0], kind="stable")]
+
+        circles = []
+        for v, x, y, r in candidates.T.tolist():
+            if all((x - xc) ** 2 + (y - yc) ** 2 > rc ** 2 for xc, yc, rc in circles):
+                print(v / self.steps, x, y, r)
+                circles.append((x, y, r))
+
+        return circles
+
+    # Searches for the radius window and threshold with which the expected
+    # number of circles is detected. Returns the best circles found
+    # and how many detector calls were spent.
+    def searchParameters(self, pMaxCalls: int) -> (list, int):
+        search = circle_search.ParameterSearch(lambda p: self.detectCircles(*p, False), len, self.numOfExpectedCircles,
+                                               pMaxCalls)
+        search.searchRadiusWindow(lambda i: (self.minRadius - i, self.maxRadius + i, self.threshold),
+                                  self.minRadius, self.maxRadius)
+
+        # Lower threshold finds more circles
+        minRadius, maxRadius, threshold = search.params
+        search.bisect(lambda v: (minRadius, maxRadius, -v / self.steps), -self.steps, -1)
+
+        return search.circles, search.calls
 
     # Sorts circles according to anchor positions
     # (anchors A, B and C) in the image
-    def sortCircles(self, pListOfCircles: list, pTypeOfImage: int) -> list:
-        markersOrder = []
-        auxList = sorted(pListOfCircles, key=itemgetter(1), reverse=True)
-        if pTypeOfImage == 1:
-            markersOrder.append(auxList[3])
-            marker2, marker1 = self.cmp(auxList[1], auxList[2])
-            markersOrder.append(marker1)
-            marker2, marker5 = self.cmp(auxList[5], marker2)
-            markersOrder.append(marker2)
-            markersOrder.append(auxList[6])
-            markersOrder.append(auxList[4])
-            markersOrder.append(marker5)
-            markersOrder.append(auxList[0])
+    def sortCircles(self, pListOfCircles: list) -> list:
+        xs, ys = [x for x, y, r in pListOfCircles], [y for x, y, r in pListOfCircles]
+        hasNozzle = marker_ordering.hasNozzle(self.numOfExpectedCircles)
 
-        else:
-            marker2, marker1 = self.cmp(auxList[1], auxList[2])
-            marker2, marker5 = self.cmp(auxList[4], marker2)
-            markersOrder.append(marker5)
-            markersOrder.append(marker1)
-            markersOrder.append(marker2)
-            markersOrder.append(auxList[5])
-            markersOrder.append(auxList[6])
-            markersOrder.append(auxList[3])
-            markersOrder.append(auxList[0])
-
-        return markersOrder
+        return [pListOfCircles[i] for i in marker_ordering.orderMarkers(xs, ys, hasNozzle)]
 
     # Finds circles in the image according to input parameters
     # using Hough Circle Transform method and calculates
@@ -113,20 +354,10 @@ class CircleDetectorWithoutCV:
         # If the previous detection was not complete or reliable
         # then the extended detection of circles starts
         if pWasSuccess == 0:
-            numOfCircles = 0
-            i = 0
-            while numOfCircles != self.numOfExpectedCircles:
-                if numOfCircles < self.numOfExpectedCircles:
-                    listOfCircles = self.detectCircles(self.minRadius - i, self.maxRadius + i, self.threshold)
-                elif numOfCircles > self.numOfExpectedCircles:
-                    listOfCircles = self.detectCircles(self.minRadius + i, self.maxRadius - i, self.threshold)
-                else:
-                    listOfCircles = self.detectCircles(self.minRadius, self.maxRadius, self.threshold)
-
-                if listOfCircles is not None:
-                    numOfCircles = int(len(listOfCircles))
-
-                i += 1
+            listOfCircles, calls = self.searchParameters(self.maxDetectorCalls)
+            numOfCircles = int(len(listOfCircles))
+            print(Fore.YELLOW + "Advanced detection used " + Style.RESET_ALL + str(calls) + Fore.YELLOW +
+                  " detector calls" + Style.RESET_ALL)
         else:
             listOfCircles = self.detectCircles(self.minRadius, self.maxRadius, self.threshold)
             numOfCircles = int(len(listOfCircles))
@@ -143,7 +374,7 @@ class CircleDetectorWithoutCV:
             # are same, then sorts circles to the correct order
             # according to anchors positions
             if numOfCircles == self.numOfExpectedCircles:
-                listOfCircles = self.sortCircles(listOfCircles, self.typeOfImage)
+                listOfCircles = self.sortCircles(listOfCircles)
 
             # Determines if the required number of circles
             # has been detected or not, calculates distances
@@ -155,31 +386,27 @@ class CircleDetectorWithoutCV:
 
                 return 0, self.filename
             else:
-                i = 0
-
-                # Extracts coordinates and radii from the detected
-                # circles and draws the circles in the image
+                # Extracts coordinates and radii from the detected circles
                 for x, y, r in listOfCircles:
-                    self.drawResult.ellipse((x - r, y - r, x + r, y + r), outline=(255, 0, 0, 0))
-                    self.drawResult.text((x, y), "{:d}.".format(i), (0, 0, 0))
                     listOfCoordsX.append(x)
                     listOfCoordsY.append(y)
                     listOfRadii.append(r)
-                    i += 1
 
                 # Calculation of distances between midpoints
-                self.distance.findAllDistances(listOfCoordsX, listOfCoordsY, listOfRadii, self.drawResult, 2)
+                self.distance.findAllDistances(listOfCoordsX, listOfCoordsY, listOfRadii)
+                self.distance.printDistances()
 
-                # Saves the image
-                nameOfImage = ""
-                if self.typeOfImage == 1:
-                    nameOfImage = "output_images/detectedCirclesOriginal_withoutOpenCV.jpg"
-                elif self.typeOfImage == 2:
-                    nameOfImage = "output_images/detectedCirclesTransformed_withoutOpenCV.jpg"
+                # Writes the result file and saves the annotated image,
+                # in headless mode only the measurement is done
+                if self.headless:
+                    return 1, None
 
-                self.outputImage.save(nameOfImage)
+                self.distance.writeResults(self.distance.resultFilename)
+                self.outputImage = self.renderer.renderWithoutCV(self.image, self.distance.markers,
+                                                                 self.distance.distances)
+                self.outputImage.save(self.outputFilename)
 
-                return 1, nameOfImage
+                return 1, self.outputFilename
 
         else:
 
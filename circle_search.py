@@ -0,0 +1,57 @@
+# Returns the radius interval (both ends included) searched
+# in the window around a circle with the given radius
+def getRadiusWindow(pRadius: float, pMargin: int) -> (int, int):
+    tolerance = max(pMargin, int(pRadius * 0.1), 1)
+
+    return int(pRadius) - tolerance, int(pRadius) + tolerance
+
+
+# Search of detector parameters shared by the advanced
+# detection of both circle detectors
+class ParameterSearch:
+    # Initialization, detect runs the detector with a tuple of parameters
+    # and count returns how many circles its result contains
+    def __init__(self, pDetect, pCount, pNumOfExpectedCircles: int, pMaxCalls: int):
+        self.detect = pDetect
+        self.countCircles = pCount
+        self.numOfExpectedCircles = pNumOfExpectedCircles
+        self.maxCalls = pMaxCalls
+        self.calls = 0
+        self.circles = None
+        self.error = None
+        self.params = None
+
+    # Detects circles and remembers the closest result so far
+    def count(self, pParams: tuple) -> int:
+        self.calls += 1
+        circles = self.detect(pParams)
+        numOfCircles = self.countCircles(circles)
+        error = abs(numOfCircles - self.numOfExpectedCircles)
+        if self.error is None or error < self.error:
+            self.circles, self.error, self.params = circles, error, pParams
+
+        return numOfCircles
+
+    # The search ends when the expected number of circles
+    # was detected or all detector calls were spent
+    def isDone(self) -> bool:
+        return self.error == 0 or self.calls >= self.maxCalls
+
+    # Finds the value in [low, high] for which the expected number
+    # of circles is detected, the count has to grow with the value
+    def bisect(self, pParams, pLow: int, pHigh: int):
+        while pLow <= pHigh and not self.isDone():
+            middle = (pLow + pHigh) // 2
+            if self.count(pParams(middle)) < self.numOfExpectedCircles:
+                pLow = middle + 1
+            else:
+                pHigh = middle - 1
+
+    # Widening the radius window finds more circles, narrowing finds less,
+    # the window maps how much it is widened to the detector parameters
+    def searchRadiusWindow(self, pWindow, pMinRadius: int, pMaxRadius: int):
+        numOfCircles = self.count(pWindow(0))
+        if numOfCircles < self.numOfExpectedCircles:
+            self.bisect(pWindow, 1, max(pMaxRadius, 1))
+        elif numOfCircles > self.numOfExpectedCircles:
+            self.bisect(pWindow, -((pMaxRadius - pMinRadius) // 2), -1)
@@ -1,5 +1,7 @@
 import cv2
 import numpy as np
+from scipy.spatial import cKDTree
+import marker_ordering
 
 
 class CornerDetector:
@@ -9,6 +11,8 @@ class CornerDetector:
         self.numOfExpectedCircles = pNumOfExpectedCircles
         self.typeOfImage = pTypeOfImage
         self.imageCopy = 0
+        self.searchInCircles = False
+        self.regionMargin = 8
 
     # Uses Harris Corner Detection method used to
     # detect all the corners in the image
@@ -24,109 +28,97 @@ class CornerDetector:
 
         return corners
 
-    # Sorting algorithm used to sort midpoints of circles according to their coordinates
-    def bubbleSort(self, pList1: list, pList2: list):
-        for i in range(0, len(pList2) - 1):
-            for j in range(len(pList2) - 1):
-                if (pList2[j] > pList2[j + 1]):
-                    temp1 = pList2[j]
-                    pList2[j] = pList2[j + 1]
-                    pList2[j + 1] = temp1
-
-                    temp2 = pList1[j]
-                    pList1[j] = pList1[j + 1]
-                    pList1[j + 1] = temp2
-
-        pList1.reverse()
-        pList2.reverse()
-
-    # Sorts midpoints of circles according to anchor positions (anchors A, B and C)
-    def sortMidpoints(self, pListOfMidpointsX: list, pListOfMidpointsY: list, pTypeOfImage: int) -> (list, list):
-        listX = []
-        listY = []
-        if pTypeOfImage == 1:
-            listX.append(pListOfMidpointsX[3])
-            listX.append(pListOfMidpointsX[1])
-            listX.append(pListOfMidpointsX[5])
-            listX.append(pListOfMidpointsX[6])
-            listX.append(pListOfMidpointsX[4])
-            listX.append(pListOfMidpointsX[2])
-            listX.append(pListOfMidpointsX[0])
-
-            listY.append(pListOfMidpointsY[3])
-            listY.append(pListOfMidpointsY[1])
-            listY.append(pListOfMidpointsY[5])
-            listY.append(pListOfMidpointsY[6])
-            listY.append(pListOfMidpointsY[4])
-            listY.append(pListOfMidpointsY[2])
-            listY.append(pListOfMidpointsY[0])
-        else:
-            listX.append(pListOfMidpointsX[3])
-            listX.append(pListOfMidpointsX[1])
-            listX.append(pListOfMidpointsX[2])
-            listX.append(pListOfMidpointsX[5])
-            listX.append(pListOfMidpointsX[6])
-            listX.append(pListOfMidpointsX[4])
-            listX.append(pListOfMidpointsX[0])
-
-            listY.append(pListOfMidpointsY[3])
-            listY.append(pListOfMidpointsY[1])
-            listY.append(pListOfMidpointsY[2])
-            listY.append(pListOfMidpointsY[5])
-            listY.append(pListOfMidpointsY[6])
-            listY.append(pListOfMidpointsY[4])
-            listY.append(pListOfMidpointsY[0])
-
-        return listX, listY
+    # Uses Harris Corner Detection method only in the bounding boxes of the circles.
+    # The margin keeps the responses inside the boxes equal to the whole image.
+    def detectCornersInCircles(self, pListOfCoordsX: list, pListOfCoordsY: list, pListOfRadii: list) -> np.ndarray:
+        height, width = self.image.shape[:2]
+        regions = []
+        for x, y, r in zip(pListOfCoordsX, pListOfCoordsY, pListOfRadii):
+            box = (int(x - r), int(y - r), int(x + r) + 1, int(y + r) + 1)
+            x0, y0 = max(box[0] - self.regionMargin, 0), max(box[1] - self.regionMargin, 0)
+            x1, y1 = min(box[2] + self.regionMargin, width), min(box[3] + self.regionMargin, height)
+            if x1 <= x0 or y1 <= y0:
+                continue
+
+            gray = np.float32(cv2.cvtColor(self.image[y0:y1, x0:x1], cv2.COLOR_BGR2GRAY))
+            regions.append((x0, y0, box, gray, cv2.cornerHarris(gray, 5, 3, 0.04)))
+
+        if not regions:
+            return np.empty((0, 2), dtype=np.float32)
+
+        maximum = max(dst.max() for _, _, _, _, dst in regions)
+        criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 100, 0.001)
+        corners = []
+        for x0, y0, box, gray, dst in regions:
+            ret, dst = cv2.threshold(dst, 0.1 * maximum, 255, 0)
+            ret, labels, stats, centroids = cv2.connectedComponentsWithStats(np.uint8(dst))
+            if ret < 2:
+                continue
+
+            # The first component is the background
+            subPix = cv2.cornerSubPix(gray, np.float32(centroids[1:]), (5, 5), (-1, -1), criteria)
+            subPix += np.float32([x0, y0])
+
+            # Corners in the margin belong to the box of another circle
+            isInside = ((subPix[:, 0] >= box[0]) & (subPix[:, 0] < box[2]) &
+                        (subPix[:, 1] >= box[1]) & (subPix[:, 1] < box[3]))
+            corners.append(subPix[isInside])
+
+        if not corners:
+            return np.empty((0, 2), dtype=np.float32)
+
+        return np.concatenate(corners)
+
+    # Assigns to every circle the nearest free corner inside its bounding box.
+    # Returns corners in the order of circles, None if the box has no corner.
+    def assignCornersToCircles(self, pCorners: np.ndarray, pListOfCoordsX: list, pListOfCoordsY: list,
+                               pListOfRadii: list) -> list:
+        assigned = [None] * len(pListOfCoordsX)
+        if not len(pCorners):
+            return assigned
+
+        corners = np.asarray(pCorners, dtype=np.float64).reshape(-1, 2)
+        tree = cKDTree(corners)
+        pairs = []
+        for j, (x, y, r) in enumerate(zip(pListOfCoordsX, pListOfCoordsY, pListOfRadii)):
+            indices = np.array(tree.query_ball_point((x, y), r, p=np.inf), dtype=np.int64)
+            distances = np.hypot(corners[indices, 0] - x, corners[indices, 1] - y)
+            pairs.extend(zip(distances.tolist(), [j] * len(indices), indices.tolist()))
+
+        isUsed = np.zeros(len(corners), dtype=bool)
+        for distance, j, i in sorted(pairs):
+            if assigned[j] is None and not isUsed[i]:
+                assigned[j] = corners[i]
+                isUsed[i] = True
+
+        return assigned
 
     # Modified Hough Circle Transform based on Harris corner detection method
-    # defines new midpoints of circles in the image
-    def findMidpointsOfCircles(self, pListOfCoordsX: list, pListOfCoordsY: list, pListOfRadii: list) -> (list, list):
-        corners = self.detectCorners()
-        listOfCorners = []
-        listOfCornersX = []
-        listOfCornersY = []
-
-        # Filtering out all corners that are not in any of the circles
-        for i in range(1, len(corners)):
-            for j in range(len(corners[i])):
-                listOfCorners.append(corners[i][j])
-
-        # Dividing the coordinates of the corners that are
-        # in one of the circles into X coord and Y coord
-        for i in range(len(listOfCorners)):
-            if i % 2 == 0:
-                listOfCornersX.append(listOfCorners[i])
-            else:
-                listOfCornersY.append(listOfCorners[i])
-
-        listOfMidpointsX = []
-        listOfMidpointsY = []
+    # defines new midpoints of circles in the image. Returns them sorted
+    # according to anchors together with radii of their circles.
+    def findMidpointsOfCircles(self, pListOfCoordsX: list, pListOfCoordsY: list,
+                               pListOfRadii: list) -> (list, list, list):
+        # The first corner of the whole image is the centroid of the background
+        if self.searchInCircles:
+            corners = self.detectCornersInCircles(pListOfCoordsX, pListOfCoordsY, pListOfRadii)
+        else:
+            corners = self.detectCorners()[1:]
 
         # The corner that is closest to the center of the circle
         # detected so far becomes the new center of the circle
-        for i in range(len(listOfCornersX)):
-            for j in range(len(pListOfCoordsX)):
-                if (listOfCornersX[i] >= (pListOfCoordsX[j] - pListOfRadii[j]) and
-                        listOfCornersX[i] <= (pListOfCoordsX[j] + pListOfRadii[j])):
-                    if (listOfCornersY[i] >= (pListOfCoordsY[j] - pListOfRadii[j]) and
-                            listOfCornersY[i] <= (pListOfCoordsY[j] + pListOfRadii[j])):
-                        pListOfCoordsX.remove(pListOfCoordsX[j])
-                        pListOfCoordsY.remove(pListOfCoordsY[j])
-                        listOfMidpointsX.append(int(listOfCornersX[i]))
-                        listOfMidpointsY.append(int(listOfCornersY[i]))
-                        break
-
-        # Sorts midpoints of final circles from the largest
-        # coordinates to the smallest coordinates
-        self.bubbleSort(listOfMidpointsX, listOfMidpointsY)
-
-        # Sorts previously sorted midpoints of circles to
-        # the correct order according to anchors
-        if len(listOfMidpointsX) == self.numOfExpectedCircles:
-            markersCorrectOrderX, markersCorrectOrderY = self.sortMidpoints(listOfMidpointsX, listOfMidpointsY,
-                                                                            self.typeOfImage)
-        else:
-            markersCorrectOrderX, markersCorrectOrderY = listOfMidpointsX, listOfMidpointsY
-
-        return (markersCorrectOrderX, markersCorrectOrderY)
+        listOfMidpointsX = []
+        listOfMidpointsY = []
+        listOfRadii = []
+        for corner, r in zip(self.assignCornersToCircles(corners, pListOfCoordsX, pListOfCoordsY, pListOfRadii),
+                             pListOfRadii):
+            if corner is not None:
+                listOfMidpointsX.append(int(corner[0]))
+                listOfMidpointsY.append(int(corner[1]))
+                listOfRadii.append(r)
+
+        # Sorts midpoints to the correct order according to anchors
+        order = marker_ordering.orderMarkers(listOfMidpointsX, listOfMidpointsY,
+                                             marker_ordering.hasNozzle(self.numOfExpectedCircles))
+
+        return ([listOfMidpointsX[i] for i in order], [listOfMidpointsY[i] for i in order],
+                [listOfRadii[i] for i in order])
@@ -1,7 +1,7 @@
-import cv2
 import math
-import random
+import json
 import numpy as np
+from scipy.spatial.distance import pdist, squareform
 
 
 class DistanceCalculator:
@@ -9,14 +9,20 @@ class DistanceCalculator:
     def __init__(self, pObjSize: int):
         self.objSize = pObjSize
         self.averageDiameter = 0
-
-    # Calculation of the average circle diameter
+        self.markers = []
+        self.distances = []
+        self.distanceMatrix = np.zeros((0, 0))
+        self.scale = 1.0
+        self.resultFilename = "result.json"
+
+    # Calculation of the average circle diameter, the largest
+    # circle is left out of the average
     def setAverageDiameter(self, pRadii: list):
-        for x in range(len(pRadii)):
-            self.averageDiameter = self.averageDiameter + 2 * pRadii[x]
-
-        self.averageDiameter = self.averageDiameter - 2 * max(pRadii)
-        self.averageDiameter = self.averageDiameter / (len(pRadii) - 1)
+        diameters = 2 * np.asarray(pRadii, dtype=np.float64)
+        if len(diameters) < 2:
+            self.averageDiameter = float(diameters.sum())
+        else:
+            self.averageDiameter = float((diameters.sum() - diameters.max()) / (len(diameters) - 1))
 
     # Returns average circle diameter
     def getAverageDiameter(self) -> float:
@@ -26,79 +32,59 @@ class DistanceCalculator:
     # based on the Euclidean distance and the size ratio of the actual
     # circle (in mm) and the detected circle (in px)
     def calculateDistance(self, pPointA: tuple, pPointB: tuple) -> float:
-        x1, y1 = pPointA
-        x2, y2 = pPointB
-
-        if x1 < x2:
-            width = x2 - x1
-        elif x1 == x2:
-            width = 0
-        else:
-            width = x1 - x2
+        sizeOfOnePixel = self.objSize / self.getAverageDiameter()
 
-        if y1 < y2:
-            height = y2 - y1
-        elif y1 == y2:
-            height = 0
-        else:
-            height = y1 - y2
+        return math.hypot(pPointB[0] - pPointA[0], pPointB[1] - pPointA[1]) * sizeOfOnePixel
+
+    # Calculation of the distances (in mm) between the centers of all
+    # circles at once, returns the symmetric N x N matrix
+    def calculateDistanceMatrix(self, pCoordsX: list, pCoordsY: list) -> np.ndarray:
+        points = np.column_stack((np.asarray(pCoordsX, dtype=np.float64), np.asarray(pCoordsY, dtype=np.float64)))
+        if len(points) < 2:
+            return np.zeros((len(points), len(points)))
+
+        return squareform(pdist(points)) * (self.objSize / self.getAverageDiameter())
+
+    # Prints distances between the centers of all circles
+    def printDistances(self):
+        for i, j, distance in self.distances:
+            print(i + 1, "->", j + 1, "=", distance, "mm")
+
+    # Returns results of the last calculation. Markers are in pixels of the input image
+    # (scale is the working image relative to it) and distances in millimeters.
+    def getResults(self) -> dict:
+        return {
+            "objSize": self.objSize,
+            "scale": self.scale,
+            "averageDiameter": float(self.averageDiameter) / self.scale,
+            "markers": [{"x": float(x) / self.scale, "y": float(y) / self.scale, "radius": float(r) / self.scale}
+                        for x, y, r in self.markers],
+            "distanceMatrix": self.distanceMatrix.tolist(),
+        }
+
+    # Writes results of the last calculation to the JSON file
+    def writeResults(self, pFilename: str):
+        with open(pFilename, "w") as file:
+            json.dump(self.getResults(), file, indent=2)
 
-        if height == 0:
-            return width
-        elif width == 0:
-            return height
+    # Determine the distance between the centers of all detected circles,
+    # returns the matrix of distances
+    def findAllDistances(self, pCoordsX: list, pCoordsY: list, pRadii: list) -> np.ndarray:
+        self.setAverageDiameter(pRadii)
+        self.markers = list(zip(pCoordsX, pCoordsY, pRadii))
+        self.distanceMatrix = self.calculateDistanceMatrix(pCoordsX, pCoordsY)
+        rows, columns = np.triu_indices(len(self.markers), k=1)
+        self.distances = list(zip(rows.tolist(), columns.tolist(), self.distanceMatrix[rows, columns].tolist()))
 
-        sizeOfOnePixel = self.objSize / self.getAverageDiameter()
+        return self.distanceMatrix
 
-        return math.sqrt(((width * sizeOfOnePixel) ** 2) + ((height * sizeOfOnePixel) ** 2))
 
-    # Find the center of the circle
-    def midPoint(self, pPointA: tuple, pPointB: tuple) -> tuple:
-        return ((pPointA[0] + pPointB[0]) * 0.5, (pPointA[1] + pPointB[1]) * 0.5)
+# Returns distances between all pairs of markers from the results file
+# in the order of the pairs (0 -> 1, 0 -> 2, ..., 1 -> 2, ...).
+# With the nozzle first these are the 21 measurements of the markers.
+def loadMeasurements(pFilename: str) -> np.ndarray:
+    with open(pFilename, "r") as file:
+        matrix = np.array(json.load(file)["distanceMatrix"], dtype=np.float64)
+    rows, columns = np.triu_indices(len(matrix), k=1)
 
-    # Determine the distance between the centers of all detected circles,
-    # write these distances to a file and draw in an image
-    def findAllDistances(self, pCoordsX: list, pCoordsY: list, pRadii: list, pImage: np.ndarray,
-                         pOption: int) -> np.ndarray:
-        self.setAverageDiameter(pRadii)
-        i = 0
-        j = 0
-        file = open("result.txt", "w")
-
-        while i < len(pCoordsX):
-            pointA = (pCoordsX[i], pCoordsY[i])
-
-            while j < len(pCoordsY):
-                if j > i:
-                    pointB = (pCoordsX[j], pCoordsY[j])
-                    color = (random.randint(0, 255), random.randint(0, 255),
-                             random.randint(0, 255))
-                    if pOption == 1:
-                        cv2.line(pImage, (pCoordsX[i], pCoordsY[i]), (pCoordsX[j], pCoordsY[j]),
-                                 color, 2)
-                    elif pOption == 2:
-                        pImage.line((pCoordsX[i], pCoordsY[i], pCoordsX[j], pCoordsY[j]),
-                                    (random.randint(0, 255), random.randint(0, 255),
-                                     random.randint(0, 255)))
-
-                    distance = self.calculateDistance(pointA, pointB)
-                    (mX, mY) = self.midPoint((pCoordsX[i], pCoordsY[i]), (pCoordsX[j], pCoordsY[j]))
-
-                    if pOption == 1:
-                        cv2.putText(pImage, "{:.2f}mm".format(distance), (int(mX + 10), int(mY + 15)),
-                                    cv2.FONT_HERSHEY_SIMPLEX, 0.7, color, 2)
-                    elif pOption == 2:
-                        pImage.text((int(mX), int(mY + 20)), "{:.2f}mm".format(distance), (83, 34, 171))
-
-                    file.write(str(i) + " -> " + str(j) + " = " + str(round(distance, 2)) + "\n")
-                    print(i + 1, "->", j + 1, "=", distance, "mm")
-
-                j += 1
-
-            j = 0
-            i += 1
-
-        file.write("\n")
-        file.close()
-
-        return pImage
+    return matrix[rows, columns]
@@ -18,12 +18,29 @@ import xml.etree.ElementTree
 from colorama import Fore, Style
 import numpy as np
 import scipy.optimize
+from concurrent.futures import ProcessPoolExecutor
+import json
 import argparse
 import sys
 import xml.etree.cElementTree as ET
+import distance_calculator
 
 
 class FindMarkersPositions:
+    # Initialization, the least squares method fills in statistics of the stages.
+    # With more than one start the markers are solved from several guesses.
+    # Warm start begins iterative solvers from the closed-form estimates.
+    def __init__(self):
+        self.bound = 1000.0
+        self.methods = ("SLSQP", "L-BFGS-B", "PowellDirectionalSolver", "differentialEvolutionSolver",
+                        "least_squares", "MDS")
+        self.warmStart = True
+        self.verbose = True
+        self.numOfStarts = 1
+        self.numOfWorkers = None
+        self.seed = 0
+        self.multiStartCosts = None
+        self.statistics = {}
 
     # Converts position vector to matrix with nozzle
     def positionVectorToMatrixWithNozzle(self, pPositionVector: np.ndarray,
@@ -64,29 +81,7 @@ class FindMarkersPositions:
         #                M3-M4, M3-M5,
         #                M4-M5
 
-        return (
-                + pow(np.linalg.norm(pPositions[0] - pPositions[1], 2) - pMeasurements[0], 2)
-                + pow(np.linalg.norm(pPositions[0] - pPositions[2], 2) - pMeasurements[1], 2)
-                + pow(np.linalg.norm(pPositions[0] - pPositions[3], 2) - pMeasurements[2], 2)
-                + pow(np.linalg.norm(pPositions[0] - pPositions[4], 2) - pMeasurements[3], 2)
-                + pow(np.linalg.norm(pPositions[0] - pPositions[5], 2) - pMeasurements[4], 2)
-                + pow(np.linalg.norm(pPositions[0] - pPositions[6], 2) - pMeasurements[5], 2)
-                + pow(np.linalg.norm(pPositions[1] - pPositions[2], 2) - pMeasurements[6], 2)
-                + pow(np.linalg.norm(pPositions[1] - pPositions[3], 2) - pMeasurements[7], 2)
-                + pow(np.linalg.norm(pPositions[1] - pPositions[4], 2) - pMeasurements[8], 2)
-                + pow(np.linalg.norm(pPositions[1] - pPositions[5], 2) - pMeasurements[9], 2)
-                + pow(np.linalg.norm(pPositions[1] - pPositions[6], 2) - pMeasurements[10], 2)
-                + pow(np.linalg.norm(pPositions[2] - pPositions[3], 2) - pMeasurements[11], 2)
-                + pow(np.linalg.norm(pPositions[2] - pPositions[4], 2) - pMeasurements[12], 2)
-                + pow(np.linalg.norm(pPositions[2] - pPositions[5], 2) - pMeasurements[13], 2)
-                + pow(np.linalg.norm(pPositions[2] - pPositions[6], 2) - pMeasurements[14], 2)
-                + pow(np.linalg.norm(pPositions[3] - pPositions[4], 2) - pMeasurements[15], 2)
-                + pow(np.linalg.norm(pPositions[3] - pPositions[5], 2) - pMeasurements[16], 2)
-                + pow(np.linalg.norm(pPositions[3] - pPositions[6], 2) - pMeasurements[17], 2)
-                + pow(np.linalg.norm(pPositions[4] - pPositions[5], 2) - pMeasurements[18], 2)
-                + pow(np.linalg.norm(pPositions[4] - pPositions[6], 2) - pMeasurements[19], 2)
-                + pow(np.linalg.norm(pPositions[5] - pPositions[6], 2) - pMeasurements[20], 2)
-        )
+        return np.sum(self.residuals(pPositions, pMeasurements) ** 2)
 
     # Calculates cost without nozzle
     def costWithoutNozzle(self, pPositions: np.ndarray, pMeasurements: np.ndarray) -> np.float64:
@@ -103,68 +98,137 @@ class FindMarkersPositions:
         #                M3-M4, M3-M5,
         #                M4-M5
 
-        return (
-                +pow(np.linalg.norm(pPositions[0] - pPositions[1], 2) - pMeasurements[0], 2)
-                + pow(np.linalg.norm(pPositions[0] - pPositions[2], 2) - pMeasurements[1], 2)
-                + pow(np.linalg.norm(pPositions[0] - pPositions[3], 2) - pMeasurements[2], 2)
-                + pow(np.linalg.norm(pPositions[0] - pPositions[4], 2) - pMeasurements[3], 2)
-                + pow(np.linalg.norm(pPositions[0] - pPositions[5], 2) - pMeasurements[4], 2)
-                + pow(np.linalg.norm(pPositions[1] - pPositions[2], 2) - pMeasurements[5], 2)
-                + pow(np.linalg.norm(pPositions[1] - pPositions[3], 2) - pMeasurements[6], 2)
-                + pow(np.linalg.norm(pPositions[1] - pPositions[4], 2) - pMeasurements[7], 2)
-                + pow(np.linalg.norm(pPositions[1] - pPositions[5], 2) - pMeasurements[8], 2)
-                + pow(np.linalg.norm(pPositions[2] - pPositions[3], 2) - pMeasurements[9], 2)
-                + pow(np.linalg.norm(pPositions[2] - pPositions[4], 2) - pMeasurements[10], 2)
-                + pow(np.linalg.norm(pPositions[2] - pPositions[5], 2) - pMeasurements[11], 2)
-                + pow(np.linalg.norm(pPositions[3] - pPositions[4], 2) - pMeasurements[12], 2)
-                + pow(np.linalg.norm(pPositions[3] - pPositions[5], 2) - pMeasurements[13], 2)
-                + pow(np.linalg.norm(pPositions[4] - pPositions[5], 2) - pMeasurements[14], 2)
+        return np.sum(self.residuals(pPositions, pMeasurements) ** 2)
+
+    # Returns indices (i, j) of all pairs of markers in the usual ccw order
+    # of the measurements (0-1, 0-2, ..., 1-2, ...)
+    def pairIndices(self, pNumOfMarkers: int) -> (np.ndarray, np.ndarray):
+        return np.triu_indices(pNumOfMarkers, k=1)
+
+    # Calculates differences between distances of all pairs of markers
+    # and their measurements
+    def residuals(self, pPositions: np.ndarray, pMeasurements: np.ndarray) -> np.ndarray:
+        first, second = self.pairIndices(len(pPositions))
+        return np.linalg.norm(pPositions[first] - pPositions[second], axis=1) - pMeasurements
+
+    # Calculates derivatives of the residuals by the flattened positions.
+    # Coincident markers use the unit vector along the diagonal.
+    def residualsJacobian(self, pPositions: np.ndarray) -> np.ndarray:
+        numOfMarkers, dimension = pPositions.shape
+        first, second = self.pairIndices(numOfMarkers)
+        differences = pPositions[first] - pPositions[second]
+        norms = np.linalg.norm(differences, axis=1)
+        directions = np.full(differences.shape, 1.0 / np.sqrt(dimension))
+        isApart = norms > 0
+        directions[isApart] = differences[isApart] / norms[isApart, None]
+
+        jacobian = np.zeros((len(first), numOfMarkers, dimension))
+        pairs = np.arange(len(first))
+        jacobian[pairs, first] = directions
+        jacobian[pairs, second] = -directions
+
+        return jacobian.reshape(len(first), numOfMarkers * dimension)
+
+    # Returns the linear mapping of the position vector
+    # (of markers without nozzle) to the flattened positions
+    def positionVectorJacobianWithoutNozzle(self, pSize: int) -> np.ndarray:
+        return np.column_stack([self.positionVectorToMatrixWithoutNozzle(unit).ravel() for unit in np.eye(pSize)])
+
+    # Returns the linear mapping of the nozzle offset to the flattened positions.
+    # The nozzle stays at the origin and markers move against the offset.
+    def positionVectorJacobianWithNozzle(self, pNumOfMarkers: int) -> np.ndarray:
+        return np.vstack((np.zeros((3, 3)), np.tile(-np.eye(3), (pNumOfMarkers - 1, 1))))
+
+    # Returns names of all pairs of markers in the order of the measurements,
+    # with 7 markers the first one is the nozzle
+    def pairNames(self, pNumOfMarkers: int) -> list:
+        names = ["M%d" % i for i in range(6)]
+        if pNumOfMarkers == 7:
+            names = ["Nozzle"] + names
+        first, second = self.pairIndices(pNumOfMarkers)
+
+        return [names[i] + "-" + names[j] for i, j in zip(first, second)]
+
+    # Options of L-BFGS-B, its disp option is deprecated and given only to print
+    def getLbfgsbOptions(self, pVerbose: bool) -> dict:
+        options = {"ftol": 1e-12, "gtol": 1e-12, "maxiter": 50000, "maxfun": 1000000}
+        if pVerbose:
+            options["disp"] = True
+
+        return options
+
+    # Minimizes the residuals by the trust region reflective method within the bounds.
+    # Keeps residuals, covariance (J^T J)^-1 * s^2 and standard errors of the stage.
+    def solveLeastSquares(self, pResiduals, pJacobian, pGuess: list, pLowerBound: list, pUpperBound: list,
+                          pNames: list, pStage: str, pVerbose: bool = True) -> scipy.optimize.OptimizeResult:
+        sol = scipy.optimize.least_squares(
+            pResiduals,
+            pGuess,
+            jac=pJacobian,
+            bounds=(pLowerBound, pUpperBound),
+            method="trf",
+            x_scale="jac",
+            ftol=1e-12,
+            xtol=1e-12,
+            gtol=1e-12,
+            max_nfev=1000,
+            verbose=1 if pVerbose else 0,
         )
 
-    # Finds reasonable markers positions based on a set of measurements
-    def solve(self, pMeasurements: np.ndarray, pMethod: str):
-        print(pMethod)
-
-        marker_measurements = pMeasurements
-        if np.size(pMeasurements) == 21:
-            marker_measurements = pMeasurements[(21 - 15):]
-
+        degreesOfFreedom = max(len(sol.fun) - len(sol.x), 1)
+        variance = np.sum(sol.fun ** 2) / degreesOfFreedom
+        covariance = np.linalg.pinv(sol.jac.T @ sol.jac) * variance
+        statistics = {
+            "residuals": dict(zip(pNames, sol.fun.tolist())),
+            "covariance": covariance.tolist(),
+            "standardErrors": np.sqrt(np.clip(np.diag(covariance), 0, None)).tolist(),
+        }
+        self.statistics[pStage] = statistics
+        if not pVerbose:
+            return sol
+
+        print(Fore.GREEN + "Function evaluations:" + Style.RESET_ALL + " ", sol.nfev)
+        print(Fore.GREEN + "Residuals of measurements:" + Style.RESET_ALL)
+        for name, residual in statistics["residuals"].items():
+            print("{0:>10s} {1: 10.4f}".format(name, residual))
+        print(Fore.GREEN + "Standard errors of parameters:" + Style.RESET_ALL + " ", statistics["standardErrors"])
+
+        return sol
+
+    # Finds positions of markers without nozzle from the initial guess
+    # (zeros by default). Returns the best cost and position vector.
+    def solveWithoutNozzle(self, pMarkerMeasurements: np.ndarray, pMethod: str, pGuess: np.ndarray = None,
+                           pVerbose: bool = True) -> (float, np.ndarray):
         # M0 has known positions (0, 0, 0)
         # M1 has unknown x-position
         # All others have unknown xy-positions
         num_params = 0 + 1 + 2 + 2 + 2 + 2
 
-        bound = 1000.0
-        lower_bound = [
-            0.0,
-            0.0,
-            0.0,
-            -bound,
-            0.0,
-            -bound,
-            0.0,
-            -bound,
-            0.0,
-        ]
-        upper_bound = [
-            bound,
-            bound,
-            bound,
-            bound,
-            bound,
-            bound,
-            bound,
-            bound,
-            bound,
-        ]
+        lower_bound, upper_bound = self.getBoundsWithoutNozzle()
 
         # This is identical function to costWithoutNozzle,
         # except the shape of inputs
         def costXWithoutNozzle(pPositionVector: np.ndarray) -> np.float64:
             positions = self.positionVectorToMatrixWithoutNozzle(pPositionVector)
-            return self.costWithoutNozzle(positions, marker_measurements)
+            return self.costWithoutNozzle(positions, pMarkerMeasurements)
+
+        # Gradient of the cost by the chain rule through the linear
+        # mapping of the position vector to positions
+        mappingWithoutNozzle = self.positionVectorJacobianWithoutNozzle(num_params)
+
+        def gradientXWithoutNozzle(pPositionVector: np.ndarray) -> np.ndarray:
+            positions = self.positionVectorToMatrixWithoutNozzle(pPositionVector)
+            residuals = self.residuals(positions, pMarkerMeasurements)
+            return 2 * (residuals @ self.residualsJacobian(positions)) @ mappingWithoutNozzle
 
-        guess_0 = [0.0] * num_params
+        def residualsXWithoutNozzle(pPositionVector: np.ndarray) -> np.ndarray:
+            return self.residuals(self.positionVectorToMatrixWithoutNozzle(pPositionVector), pMarkerMeasurements)
+
+        def jacobianXWithoutNozzle(pPositionVector: np.ndarray) -> np.ndarray:
+            positions = self.positionVectorToMatrixWithoutNozzle(pPositionVector)
+            return self.residualsJacobian(positions) @ mappingWithoutNozzle
+
+        guess_0 = [0.0] * num_params if pGuess is None else list(pGuess)
 
         # Here begins optimization methods for finding best intermediate cost
         intermediate_cost = 0.0
@@ -173,10 +237,11 @@ class FindMarkersPositions:
             sol = scipy.optimize.minimize(
                 costXWithoutNozzle,
                 guess_0,
+                jac=gradientXWithoutNozzle,
                 method="SLSQP",
                 bounds=list(zip(lower_bound, upper_bound)),
                 tol=1e-20,
-                options={"disp": True, "ftol": 1e-40, "eps": 1e-10, "maxiter": 500},
+                options={"disp": pVerbose, "ftol": 1e-40, "eps": 1e-10, "maxiter": 500},
             )
             intermediate_cost = sol.fun
             intermediate_solution = sol.x
@@ -184,12 +249,21 @@ class FindMarkersPositions:
             sol = scipy.optimize.minimize(
                 costXWithoutNozzle,
                 guess_0,
+                jac=gradientXWithoutNozzle,
                 method="L-BFGS-B",
                 bounds=list(zip(lower_bound, upper_bound)),
-                options={"disp": True, "ftol": 1e-12, "gtol": 1e-12, "maxiter": 50000, "maxfun": 1000000},
+                options=self.getLbfgsbOptions(pVerbose),
             )
             intermediate_cost = sol.fun
             intermediate_solution = sol.x
+        elif pMethod == "least_squares":
+            sol = self.solveLeastSquares(residualsXWithoutNozzle, jacobianXWithoutNozzle, guess_0, lower_bound,
+                                         upper_bound, self.pairNames(6), "intermediate", pVerbose)
+            intermediate_cost = 2 * sol.cost
+            intermediate_solution = sol.x
+        elif pMethod == "MDS":
+            intermediate_solution = self.classicalMdsGuess(pMarkerMeasurements)
+            intermediate_cost = costXWithoutNozzle(intermediate_solution)
         elif pMethod == "PowellDirectionalSolver":
             from mystic.solvers import PowellDirectionalSolver
             from mystic.termination import Or, CollapseAt, CollapseAs
@@ -198,11 +272,12 @@ class FindMarkersPositions:
             from mystic.termination import VTR, And, Or
 
             solver = PowellDirectionalSolver(num_params)
-            solver.SetRandomInitialPoints(lower_bound, upper_bound)
+            self.setInitialPoints(solver, pGuess, lower_bound, upper_bound)
             solver.SetEvaluationLimits(evaluations=3200000, generations=100000)
             solver.SetTermination(Or(VTR(1e-25), COG(1e-10, 20)))
             solver.SetStrictRanges(lower_bound, upper_bound)
-            solver.SetGenerationMonitor(VerboseMonitor(5))
+            if pVerbose:
+                solver.SetGenerationMonitor(VerboseMonitor(5))
             solver.Solve(costXWithoutNozzle)
             intermediate_cost = solver.bestEnergy
             intermediate_solution = solver.bestSolution
@@ -217,9 +292,10 @@ class FindMarkersPositions:
             stepmon = VerboseMonitor(100)
             solver = DifferentialEvolutionSolver2(num_params, npop)
             solver.SetEvaluationLimits(evaluations=3200000, generations=100000)
-            solver.SetRandomInitialPoints(lower_bound, upper_bound)
+            self.setInitialPoints(solver, pGuess, lower_bound, upper_bound)
             solver.SetStrictRanges(lower_bound, upper_bound)
-            solver.SetGenerationMonitor(stepmon)
+            if pVerbose:
+                solver.SetGenerationMonitor(stepmon)
             solver.Solve(
                 costXWithoutNozzle,
                 termination=stop,
@@ -230,15 +306,127 @@ class FindMarkersPositions:
         else:
             print("Method %s is not supported!" % pMethod)
             sys.exit(1)
-        print(Fore.GREEN + "Best intermediate cost:" + Style.RESET_ALL + " ", intermediate_cost)
-        print(
-            Fore.GREEN + "Best intermediate positions:" + Style.RESET_ALL + "\n%s" % self.positionVectorToMatrixWithoutNozzle(
-                intermediate_solution))
-        intermediatePositions = self.positionVectorToMatrixWithoutNozzle(intermediate_solution)
-        if np.size(measurements) == 15:
-            print("Got only 15 samples, so will not try to find nozzle position\n")
+
+        return intermediate_cost, intermediate_solution
+
+    # Sets initial points of the mystic solver, random within the bounds without a guess.
+    # Otherwise the population is spread around the guess by a tenth of its size.
+    def setInitialPoints(self, pSolver, pGuess: np.ndarray, pLowerBound: list, pUpperBound: list):
+        if pGuess is None:
+            pSolver.SetRandomInitialPoints(pLowerBound, pUpperBound)
             return
-        nozzle_measurements = measurements[: (21 - 15)]
+
+        guess = np.clip(np.asarray(pGuess, dtype=np.float64), pLowerBound, pUpperBound)
+        spread = 0.1 * max(float(np.max(np.abs(guess))), 1.0)
+
+        # Radius is relative to the guess, zero values are spread by the radius itself
+        radius = np.full(len(guess), spread)
+        radius[guess != 0] = spread / np.abs(guess[guess != 0])
+        pSolver.SetInitialPoints(guess, radius)
+
+    # Estimates markers without nozzle by classical multidimensional scaling.
+    # The plane is moved so M0 is at the origin, M1 on +x and the others at +y.
+    def classicalMdsGuess(self, pMarkerMeasurements: np.ndarray) -> np.ndarray:
+        first, second = self.pairIndices(6)
+        distances = np.zeros((6, 6))
+        distances[first, second] = pMarkerMeasurements
+        distances += distances.T
+
+        centering = np.eye(6) - 1.0 / 6
+        gram = -0.5 * centering @ (distances ** 2) @ centering
+        values, vectors = np.linalg.eigh(gram)
+        points = vectors[:, -2:][:, ::-1] * np.sqrt(np.clip(values[-2:][::-1], 0, None))
+
+        points = points - points[0]
+        angle = np.arctan2(points[1, 1], points[1, 0])
+        rotation = np.array([[np.cos(angle), np.sin(angle)], [-np.sin(angle), np.cos(angle)]])
+        points = points @ rotation.T
+        if points[2:, 1].sum() < 0:
+            points[:, 1] = -points[:, 1]
+
+        guess = np.concatenate(([points[1, 0]], points[2:].ravel()))
+        lowerBound, upperBound = self.getBoundsWithoutNozzle()
+
+        return np.clip(guess, lowerBound, upperBound)
+
+    # Estimates offset of the nozzle below the plane of markers in closed form.
+    # Differences of squared distances give x and y, the rest gives the depth.
+    def trilaterateNozzle(self, pPositionVector: np.ndarray, pNozzleMeasurements: np.ndarray) -> np.ndarray:
+        markers = self.positionVectorToMatrixWithoutNozzle(pPositionVector)[:, :2]
+        distances = np.asarray(pNozzleMeasurements, dtype=np.float64)
+        matrix = 2 * (markers[1:] - markers[0])
+        vector = (np.sum(markers[1:] ** 2, axis=1) - np.sum(markers[0] ** 2)
+                  - distances[1:] ** 2 + distances[0] ** 2)
+        position, *_ = np.linalg.lstsq(matrix, vector, rcond=None)
+        depth = np.mean(distances ** 2 - np.sum((markers - position) ** 2, axis=1))
+
+        nozzle = np.array([position[0], position[1], -np.sqrt(max(depth, 0.0))])
+
+        return np.clip(nozzle, [0.0, 0.0, -self.bound], [self.bound, self.bound, 0.0])
+
+    # Returns bounds of the position vector of markers without nozzle
+    def getBoundsWithoutNozzle(self) -> (list, list):
+        return ([0.0, 0.0, 0.0, -self.bound, 0.0, -self.bound, 0.0, -self.bound, 0.0], [self.bound] * 9)
+
+    # Solves markers from the MDS estimate and random guesses in a pool of processes.
+    # Returns the best cost and position vector and prints the spread of the costs.
+    def solveMultiStart(self, pMarkerMeasurements: np.ndarray, pMethod: str) -> (float, np.ndarray):
+        rng = np.random.default_rng(self.seed)
+        lowerBound, upperBound = self.getBoundsWithoutNozzle()
+        size = float(np.max(pMarkerMeasurements))
+        guesses = [self.classicalMdsGuess(pMarkerMeasurements)]
+        for _ in range(self.numOfStarts - 1):
+            guesses.append(np.clip(rng.uniform(-size, size, 9), lowerBound, upperBound))
+
+        tasks = [(pMarkerMeasurements, pMethod, guess) for guess in guesses]
+        with ProcessPoolExecutor(max_workers=self.numOfWorkers) as executor:
+            results = list(executor.map(solveFromGuess, tasks))
+
+        costs = np.array([cost for cost, _ in results])
+        best = int(np.argmin(costs))
+        self.multiStartCosts = costs
+        if self.verbose:
+            print(Fore.GREEN + "Costs of %d starts:" % len(costs) + Style.RESET_ALL +
+                  " best %g, median %g, worst %g" % (costs.min(), np.median(costs), costs.max()))
+            print(Fore.GREEN + "Starts reaching the best cost:" + Style.RESET_ALL + " ",
+                  int(np.sum(costs <= costs[best] + 1e-6 * max(1.0, costs[best]))))
+
+        # Residuals and covariance of the best start are reported once more
+        if pMethod == "least_squares":
+            return self.solveWithoutNozzle(pMarkerMeasurements, pMethod, results[best][1], self.verbose)
+
+        return results[best]
+
+    # Finds reasonable markers positions based on a set of measurements.
+    # Z height is asked for if it is not given. The XML file is written only if named.
+    def solve(self, pMeasurements: np.ndarray, pMethod: str, pZHeight: float = None,
+              pFilename: str = "myMarkersParams.xml") -> dict:
+        self.statistics = {}
+        if self.verbose:
+            print(pMethod)
+
+        marker_measurements = pMeasurements
+        if np.size(pMeasurements) == 21:
+            marker_measurements = pMeasurements[(21 - 15):]
+
+        bound = self.bound
+        if self.numOfStarts > 1:
+            intermediate_cost, intermediate_solution = self.solveMultiStart(marker_measurements, pMethod)
+        else:
+            guess = self.classicalMdsGuess(marker_measurements) if self.warmStart else None
+            intermediate_cost, intermediate_solution = self.solveWithoutNozzle(marker_measurements, pMethod, guess,
+                                                                               self.verbose)
+
+        intermediatePositions = self.positionVectorToMatrixWithoutNozzle(intermediate_solution)
+        if self.verbose:
+            print(Fore.GREEN + "Best intermediate cost:" + Style.RESET_ALL + " ", intermediate_cost)
+            print(Fore.GREEN + "Best intermediate positions:" + Style.RESET_ALL + "\n%s" % intermediatePositions)
+        if np.size(pMeasurements) == 15:
+            if self.verbose:
+                print("Got only 15 samples, so will not try to find nozzle position\n")
+            return {"method": pMethod, "intermediateCost": float(intermediate_cost), "finalCost": None,
+                    "positions": intermediatePositions.tolist(), "statistics": self.statistics}
+        nozzle_measurements = pMeasurements[: (21 - 15)]
 
         # Look for nozzle's xyz-offset relative to marker 0
         num_params = 3
@@ -253,20 +441,38 @@ class FindMarkersPositions:
         # except the shape of inputs
         def costXWithNozzle(pPositionVector: np.ndarray) -> np.float64:
             positions = self.positionVectorToMatrixWithNozzle(pPositionVector, intermediate_solution)
-            return self.costWithNozzle(positions, measurements)
+            return self.costWithNozzle(positions, pMeasurements)
+
+        mappingWithNozzle = self.positionVectorJacobianWithNozzle(7)
+
+        def gradientXWithNozzle(pPositionVector: np.ndarray) -> np.ndarray:
+            positions = self.positionVectorToMatrixWithNozzle(pPositionVector, intermediate_solution)
+            residuals = self.residuals(positions, pMeasurements)
+            return 2 * (residuals @ self.residualsJacobian(positions)) @ mappingWithNozzle
+
+        def residualsXWithNozzle(pPositionVector: np.ndarray) -> np.ndarray:
+            positions = self.positionVectorToMatrixWithNozzle(pPositionVector, intermediate_solution)
+            return self.residuals(positions, pMeasurements)
+
+        def jacobianXWithNozzle(pPositionVector: np.ndarray) -> np.ndarray:
+            positions = self.positionVectorToMatrixWithNozzle(pPositionVector, intermediate_solution)
+            return self.residualsJacobian(positions) @ mappingWithNozzle
 
         # Here begins optimization methods for finding best final cost
-        guess_0 = [0.0, 0.0, 0.0]
+        trilaterated = self.trilaterateNozzle(intermediate_solution, nozzle_measurements)
+        guess = trilaterated if self.warmStart else None
+        guess_0 = list(trilaterated) if self.warmStart else [0.0, 0.0, 0.0]
         final_cost = 0.0
         final_solution = []
         if pMethod == "SLSQP":
             sol = scipy.optimize.minimize(
                 costXWithNozzle,
                 guess_0,
+                jac=gradientXWithNozzle,
                 method="SLSQP",
                 bounds=list(zip(lower_bound, upper_bound)),
                 tol=1e-20,
-                options={"disp": True, "ftol": 1e-40, "eps": 1e-10, "maxiter": 500},
+                options={"disp": self.verbose, "ftol": 1e-40, "eps": 1e-10, "maxiter": 500},
             )
             final_cost = sol.fun
             final_solution = sol.x
@@ -274,12 +480,21 @@ class FindMarkersPositions:
             sol = scipy.optimize.minimize(
                 costXWithNozzle,
                 guess_0,
+                jac=gradientXWithNozzle,
                 method="L-BFGS-B",
                 bounds=list(zip(lower_bound, upper_bound)),
-                options={"disp": True, "ftol": 1e-12, "gtol": 1e-12, "maxiter": 50000, "maxfun": 1000000},
+                options=self.getLbfgsbOptions(self.verbose),
             )
             final_cost = sol.fun
             final_solution = sol.x
+        elif pMethod == "least_squares":
+            sol = self.solveLeastSquares(residualsXWithNozzle, jacobianXWithNozzle, guess_0, lower_bound,
+                                         upper_bound, self.pairNames(7), "final", self.verbose)
+            final_cost = 2 * sol.cost
+            final_solution = sol.x
+        elif pMethod == "MDS":
+            final_solution = trilaterated
+            final_cost = costXWithNozzle(final_solution)
         elif pMethod == "PowellDirectionalSolver":
             from mystic.solvers import PowellDirectionalSolver
             from mystic.termination import Or, CollapseAt, CollapseAs
@@ -288,11 +503,12 @@ class FindMarkersPositions:
             from mystic.termination import VTR, And, Or
 
             solver = PowellDirectionalSolver(num_params)
-            solver.SetRandomInitialPoints(lower_bound, upper_bound)
+            self.setInitialPoints(solver, guess, lower_bound, upper_bound)
             solver.SetEvaluationLimits(evaluations=3200000, generations=100000)
             solver.SetTermination(Or(VTR(1e-25), COG(1e-10, 20)))
             solver.SetStrictRanges(lower_bound, upper_bound)
-            solver.SetGenerationMonitor(VerboseMonitor(5))
+            if self.verbose:
+                solver.SetGenerationMonitor(VerboseMonitor(5))
             solver.Solve(costXWithNozzle)
             final_cost = solver.bestEnergy
             final_solution = solver.bestSolution
@@ -307,9 +523,10 @@ class FindMarkersPositions:
             stepmon = VerboseMonitor(100)
             solver = DifferentialEvolutionSolver2(num_params, npop)
             solver.SetEvaluationLimits(evaluations=3200000, generations=100000)
-            solver.SetRandomInitialPoints(lower_bound, upper_bound)
+            self.setInitialPoints(solver, guess, lower_bound, upper_bound)
             solver.SetStrictRanges(lower_bound, upper_bound)
-            solver.SetGenerationMonitor(stepmon)
+            if self.verbose:
+                solver.SetGenerationMonitor(stepmon)
             solver.Solve(
                 costXWithNozzle,
                 termination=stop,
@@ -318,13 +535,16 @@ class FindMarkersPositions:
             final_cost = solver.bestEnergy
             final_solution = solver.bestSolution
 
-        print()
-        z_value = input(
-            Fore.MAGENTA + "Please insert Z height (distance between nozzle plane and markers plane): " + Style.RESET_ALL)
-        print()
+        z_value = pZHeight
+        if z_value is None:
+            print()
+            z_value = input(
+                Fore.MAGENTA + "Please insert Z height (distance between nozzle plane and markers plane): " + Style.RESET_ALL)
+            print()
 
-        print(Fore.GREEN + "Best final cost:" + Style.RESET_ALL + " ", final_cost)
-        print(Fore.GREEN + "Best final positions:" + Style.RESET_ALL)
+        if self.verbose:
+            print(Fore.GREEN + "Best final cost:" + Style.RESET_ALL + " ", final_cost)
+            print(Fore.GREEN + "Best final positions:" + Style.RESET_ALL)
         final = self.positionVectorToMatrixWithNozzle(final_solution, intermediate_solution)[1:]
 
         # Generates myMarkerParams.xml where are placed XYZ positions of markers on effector
@@ -339,16 +559,22 @@ class FindMarkersPositions:
         matrix = '\n'
 
         for num in range(0, 6):
-            print(
-                # "{0: 8.3f} {1: 8.3f} {2: 8.3f} <!-- Marker {3} -->".format(final[num][0], final[num][1], final[num][2], num)
-                "{0: 8.3f} {1: 8.3f} {2: 8.3f} <!-- Marker {3} -->".format(final[num][0], final[num][1], float(z_value),
-                                                                           num)
-            )
+            if self.verbose:
+                print(
+                    # "{0: 8.3f} {1: 8.3f} {2: 8.3f} <!-- Marker {3} -->".format(final[num][0], final[num][1], final[num][2], num)
+                    "{0: 8.3f} {1: 8.3f} {2: 8.3f} <!-- Marker {3} -->".format(final[num][0], final[num][1],
+                                                                               float(z_value), num)
+                )
             # matrix = matrix + str(final[num][0]) + "\t" + str(final[num][1]) + "\t" + str(final[num][2]) + "\n"
             matrix = matrix + str(round(final[num][0], 3)) + "  " + str(round(final[num][1], 3)) + "  " + str(
                 round(float(z_value), 3)) + "\n"
 
         data.text = matrix
+        positions = [[float(final[num][0]), float(final[num][1]), float(z_value)] for num in range(0, 6)]
+        result = {"method": pMethod, "intermediateCost": float(intermediate_cost), "finalCost": float(final_cost),
+                  "positions": positions, "statistics": self.statistics}
+        if not pFilename:
+            return result
 
         ET.SubElement(root, "marker_diameter").text = "90.0"
         ET.SubElement(root, "marker_type").text = "disk"
@@ -359,14 +585,15 @@ class FindMarkersPositions:
         ET.SubElement(tlMarkerCenter, "dt").text = "d"
         ET.SubElement(tlMarkerCenter, "data").text = "0 0"
 
-        filename = "myMarkersParams.xml"
+        filename = pFilename
         tree = ET.ElementTree(self.indent(root))
         tree.write(filename, xml_declaration=True, encoding="utf-8")
 
-        print()
-        print(
-            Fore.YELLOW + "XML file " + Style.RESET_ALL + filename + Fore.YELLOW + " was generated succesfully!" + Style.RESET_ALL)
-        print()
+        if self.verbose:
+            print()
+            print(Fore.YELLOW + "XML file " + Style.RESET_ALL + filename + Fore.YELLOW + " was generated succesfully!" +
+                  Style.RESET_ALL)
+            print()
 
         # HERE BEGINS PART FOR OLDER VERSIONS OF HPM
         # bedMarkers = ET.SubElement(root, "bed_markers", type_id="opencv-matrix")
@@ -387,6 +614,29 @@ class FindMarkersPositions:
         # ET.SubElement(bedMarkers, "marker_diameter").text = "90.0"
         # ET.SubElement(bedMarkers, "marker_type").text = "disk"
 
+        return result
+
+    # Solves many sets of measurements quietly in a pool of processes.
+    # A failed set gets an error in its result and the others go on.
+    def solveMany(self, pMeasurementSets: list, pMethod: str, pZHeight: float, pWorkers: int = None) -> list:
+        if pMethod not in self.methods:
+            raise ValueError("Method %s is not supported!" % pMethod)
+
+        tasks = [(np.asarray(measurements, dtype=np.float64), pMethod, pZHeight, self.warmStart)
+                 for measurements in pMeasurementSets]
+        results = []
+        with ProcessPoolExecutor(max_workers=pWorkers) as executor:
+            futures = [executor.submit(solveMeasurementSet, task) for task in tasks]
+            for index, future in enumerate(futures):
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = {"method": pMethod, "error": repr(e)}
+                result["index"] = index
+                results.append(result)
+
+        return results
+
     # Indents elements in XML file
     def indent(self, pElem: xml.etree.ElementTree.Element, pLevel=0) -> xml.etree.ElementTree.Element:
         i = "\n" + pLevel * "  "
@@ -407,6 +657,26 @@ class FindMarkersPositions:
         return pElem
 
 
+# Solves markers positions without nozzle from one initial guess,
+# used by the processes of multi-start optimization
+def solveFromGuess(pTask: tuple) -> (float, np.ndarray):
+    measurements, method, guess = pTask
+    return FindMarkersPositions().solveWithoutNozzle(measurements, method, guess, False)
+
+
+# Solves one set of measurements quietly, used by the processes of solveMany
+def solveMeasurementSet(pTask: tuple) -> dict:
+    measurements, method, zHeight, warmStart = pTask
+    if np.size(measurements) != 15 and np.size(measurements) != 21:
+        raise ValueError("Set of %d measurements is not 15 or 21 numbers" % np.size(measurements))
+
+    findPositions = FindMarkersPositions()
+    findPositions.warmStart = warmStart
+    findPositions.verbose = False
+
+    return findPositions.solve(measurements, method, zHeight, None)
+
+
 class StoreAsArray(argparse._StoreAction):
     def __call__(self, parser, namespace, values, option_string=None):
         values = np.array(values)
@@ -420,7 +690,7 @@ if __name__ == "__main__":
     parser.add_argument(
         "-m",
         "--method",
-        help="Available methods are SLSQP (0, default), L-BFGS-B (1), PowellDirectionalSolver (2), and differentialEvolutionSolver (3). SLSQP and L-BFGS-B require scipy to be installed. The others require mystic to be installed.",
+        help="Available methods are SLSQP (0, default), L-BFGS-B (1), PowellDirectionalSolver (2), differentialEvolutionSolver (3), least_squares (4) and closed-form MDS (5). SLSQP, L-BFGS-B and least_squares require scipy to be installed. The others require mystic to be installed.",
         default="SLSQP",
     )
     parser.add_argument(
@@ -432,6 +702,50 @@ if __name__ == "__main__":
         nargs="+",
         default=np.array([]),
     )
+    parser.add_argument(
+        "-r",
+        "--results",
+        help="Results file of the detection with distances between the nozzle and markers, used if no measurements are specified.",
+        default="result.json",
+    )
+    parser.add_argument(
+        "-n",
+        "--starts",
+        help="Number of initial guesses (the first one by classical MDS, the others random) optimized in parallel, the best solution is kept.",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--no-warm-start",
+        help="Start the iterative methods from zeros instead of the closed-form MDS estimate.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        help="Number of processes used by the multi-start optimization (all cores by default).",
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "-b",
+        "--batch",
+        help="File with many sets of 15 or 21 measurements (one set per row of a text file, rows of a .npy file or a JSON list of lists), all sets are solved in one run without any prompts.",
+        default=None,
+    )
+    parser.add_argument(
+        "-z",
+        "--z-height",
+        help="Z height (distance between nozzle plane and markers plane), required in batch mode, asked for otherwise.",
+        type=float,
+        default=None,
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        help="JSON file with results of batch mode.",
+        default="markersPositions.json",
+    )
     args = vars(parser.parse_args())
     if args["method"] == "0" or args["method"] == "default":
         args["method"] = "SLSQP"
@@ -441,75 +755,41 @@ if __name__ == "__main__":
         args["method"] = "PowellDirectionalSolver"
     if args["method"] == "3":
         args["method"] = "differentialEvolutionSolver"
+    if args["method"] == "4":
+        args["method"] = "least_squares"
+    if args["method"] == "5":
+        args["method"] = "MDS"
+
+    # Batch mode solves all sets of measurements from the file
+    # in a pool of processes and writes their results
+    if args["batch"] is not None:
+        if args["z_height"] is None:
+            print("Error: Batch mode requires Z height (-z/--z-height).")
+            sys.exit(1)
 
-    # Reads measurements from file and adds to a list
-    measurements = args["measurements"]
-    if np.size(measurements) == 0:
-        file = open("measures.txt", "r")
-        listOfLines = file.readlines()
-        file.close()
-
-        listOfMeasures = []
-        i = 0
-        for line in listOfLines:
-            if i < len(listOfLines):
-                measure = float(line.rstrip("\n"))
-                listOfMeasures.append(measure)
-            i += 1
-
-        if len(listOfMeasures) == 21:
-            measurements = np.array(
-                [
-                    listOfMeasures[0],
-                    listOfMeasures[1],
-                    listOfMeasures[2],
-                    listOfMeasures[3],
-                    listOfMeasures[4],
-                    listOfMeasures[5],
-                    listOfMeasures[6],
-                    listOfMeasures[7],
-                    listOfMeasures[8],
-                    listOfMeasures[9],
-                    listOfMeasures[10],
-                    listOfMeasures[11],
-                    listOfMeasures[12],
-                    listOfMeasures[13],
-                    listOfMeasures[14],
-                    listOfMeasures[15],
-                    listOfMeasures[16],
-                    listOfMeasures[17],
-                    listOfMeasures[18],
-                    listOfMeasures[19],
-                    listOfMeasures[20],
-                ]
-            )
-        elif len(listOfMeasures) == 15:
-            measurements = np.array(
-                [
-                    listOfMeasures[0],
-                    listOfMeasures[1],
-                    listOfMeasures[2],
-                    listOfMeasures[3],
-                    listOfMeasures[4],
-                    listOfMeasures[5],
-                    listOfMeasures[6],
-                    listOfMeasures[7],
-                    listOfMeasures[8],
-                    listOfMeasures[9],
-                    listOfMeasures[10],
-                    listOfMeasures[11],
-                    listOfMeasures[12],
-                    listOfMeasures[13],
-                    listOfMeasures[14],
-                ]
-            )
+        if args["batch"].endswith(".npy"):
+            measurementSets = np.load(args["batch"])
+        elif args["batch"].endswith(".json"):
+            with open(args["batch"], "r") as file:
+                measurementSets = json.load(file)
         else:
-            # Here you can manually add values
-            measurements = np.array(
-                [
+            measurementSets = np.loadtxt(args["batch"], ndmin=2)
 
-                ]
-            )
+        findPositions = FindMarkersPositions()
+        findPositions.warmStart = not args["no_warm_start"]
+        results = findPositions.solveMany(list(measurementSets), args["method"], args["z_height"], args["workers"])
+        with open(args["output"], "w") as file:
+            json.dump(results, file, indent=2)
+
+        failed = sum(1 for result in results if "error" in result)
+        print("Solved %d of %d sets of measurements, results were written to %s" % (
+            len(results) - failed, len(results), args["output"]))
+        sys.exit(0)
+
+    # Reads measurements from the results file of the detection
+    measurements = args["measurements"]
+    if np.size(measurements) == 0:
+        measurements = distance_calculator.loadMeasurements(args["results"])
     if np.size(measurements) != 15 and np.size(measurements) != 21:
         print(
             "Error: You specified %d numbers after your -e/--measurements option, which is not 15 or 21 numbers. It must be 15 or 21 numbers."
@@ -518,5 +798,9 @@ if __name__ == "__main__":
 
     findPositions = FindMarkersPositions()
 
+    findPositions.numOfStarts = args["starts"]
+    findPositions.warmStart = not args["no_warm_start"]
+    findPositions.numOfWorkers = args["workers"]
+
     # Calculates XYZ markers positions based on a set of measurements
-    findPositions.solve(measurements, args["method"])
+    findPositions.solve(measurements, args["method"], args["z_height"])
@@ -1,10 +1,12 @@
 import perspective_transformation
 import circle_detector_with_cv
 import circle_detector_without_cv
+import batch_processor
 import subprocess
 from colorama import Fore, Style
 import argparse
 import sys
+import os
 import cv2
 from PIL import Image
 import numpy as np
@@ -23,8 +25,27 @@ def main():
                     help="comma seperated list of source points")
     ap.add_argument("-s", "--size", type=float, required=False,
                     help="size of the known object in the real world (in milimeters)")
+    ap.add_argument("-b", "--batch", required=False,
+                    help="directory or glob pattern of images to be processed without any prompts")
+    ap.add_argument("-p", "--params", required=False,
+                    help="JSON file with detection parameters used in batch mode")
+    ap.add_argument("-o", "--output", required=False, default="output_batch",
+                    help="directory where results of batch mode are written")
+    ap.add_argument("-w", "--workers", type=int, required=False,
+                    help="number of processes used in batch mode (all cores by default)")
     args = vars(ap.parse_args())
 
+    # Batch mode processes all images with parameters from the file
+    # and skips the interactive menu
+    if args["batch"] is not None:
+        if args["params"] is None:
+            print(Fore.RED + "Batch mode requires parameter file (-p/--params)!" + Style.RESET_ALL)
+            sys.exit(1)
+
+        batch = batch_processor.BatchProcessor(args["params"], args["output"])
+        batch.processImages(args["batch"], args["workers"])
+        return
+
     wasEnd = False
     newImage = "output_images/afterPerspectiveTransformation.jpg"
 
@@ -206,31 +227,11 @@ def main():
         elif decision == "0":
             wasEnd = True
 
-    try:
-
-        # Extracts the necessary measurements in the correct format to a file
-        file = open("result.txt", "r")
-        listOfLines = file.readlines()
-        file.close()
-
-        file = open("measures.txt", "w")
-
-        i = 0
-        listOfMeasures = []
-        for line in listOfLines:
-            if i < len(listOfLines) - 1:
-                measure = float(line[9:])
-                listOfMeasures.append(measure)
-                file.write(str(measure) + "\n")
-            i += 1
-
-        file.close()
-
-        # Executes an external program, which will find XYZ
-        # positions of markers placed on the effector
+    # Executes an external program, which will find XYZ positions
+    # of markers placed on the effector from the results file
+    if os.path.exists("result.json"):
         subprocess.call("./find_markers_positions.py", shell=True)
-
-    except:
+    else:
         print(Fore.RED + "No detection has been performed yet!" + Style.RESET_ALL)
 
 
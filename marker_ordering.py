@@ -0,0 +1,57 @@
+from math import pi
+import numpy as np
+
+
+# Ring markers come in pairs facing the anchors A, B and C.
+# An odd number of markers includes the nozzle.
+def hasNozzle(pNumOfMarkers: int) -> bool:
+    return pNumOfMarkers % 2 == 1
+
+
+# Returns the angle around the ring centroid which separates the last marker from the first one.
+# It goes between the markers of the pair of anchor B, the neighbour pair closest to the anchor angle.
+# Without pairs it goes after the marker closest to the anchor angle.
+def findAnchorDirection(pXs: np.ndarray, pYs: np.ndarray, pAngles: np.ndarray, pAnchorAngle: float) -> float:
+    numOfMarkers = len(pAngles)
+    order = np.argsort(-pAngles, kind="stable")
+    if numOfMarkers < 4 or numOfMarkers % 2 == 1:
+        difference = np.remainder(pAngles - pAnchorAngle + pi, 2 * pi) - pi
+        anchor = int(np.argmin(np.abs(difference)))
+        following = order[(int(np.nonzero(order == anchor)[0][0]) + 1) % numOfMarkers]
+        return float(pAngles[anchor] - np.remainder(pAngles[anchor] - pAngles[following], 2 * pi) / 2)
+
+    # Gap k lies between the k-th marker and the next one counterclockwise
+    xs, ys = pXs[order], pYs[order]
+    gaps = np.hypot(np.roll(xs, -1) - xs, np.roll(ys, -1) - ys)
+    first = np.arange(0 if gaps[0::2].sum() <= gaps[1::2].sum() else 1, numOfMarkers, 2)
+    second = (first + 1) % numOfMarkers
+    directions = np.arctan2((ys[first] + ys[second]) / 2 - pYs.mean(), (xs[first] + xs[second]) / 2 - pXs.mean())
+
+    difference = np.remainder(directions - pAnchorAngle + pi, 2 * pi) - pi
+
+    return float(directions[np.argmin(np.abs(difference))])
+
+
+# Returns indices of the markers in the order of their distances.
+# The nozzle (marker closest to the centroid) comes first if there is any.
+# Ring markers follow counterclockwise from the direction of anchor B.
+def orderMarkers(pCoordsX, pCoordsY, pHasNozzle: bool = True, pAnchorAngle: float = pi / 2) -> np.ndarray:
+    xs = np.asarray(pCoordsX, dtype=np.float64).reshape(-1)
+    ys = np.asarray(pCoordsY, dtype=np.float64).reshape(-1)
+    if len(xs) < 3:
+        return np.arange(len(xs))
+
+    nozzle = []
+    ring = np.arange(len(xs))
+    if pHasNozzle:
+        nozzle = [int(np.argmin(np.hypot(xs - xs.mean(), ys - ys.mean())))]
+        ring = np.delete(ring, nozzle)
+    angles = np.arctan2(ys[ring] - ys[ring].mean(), xs[ring] - xs[ring].mean())
+
+    # Angles are measured backwards from the direction of anchor B,
+    # which closes the full turn
+    anchorDirection = findAnchorDirection(xs[ring], ys[ring], angles, pAnchorAngle)
+    keys = np.remainder(anchorDirection - angles, 2 * pi)
+    order = np.argsort(keys, kind="stable")
+
+    return np.concatenate((nozzle, ring[order])).astype(np.int64)
@@ -12,6 +12,7 @@ class PerspectiveTransformation:
 
         self.wasResize = False
         originalDimensions = self.image.shape
+        self.dimensions = originalDimensions
 
         # Resize input image if the image is too big
         if (originalDimensions[1] > 2000):
@@ -36,8 +37,9 @@ class PerspectiveTransformation:
         cv2.imshow("Original Image", self.image)
         cv2.waitKey(0)
 
-    # Calculates and applies a perspective transformation to an image
-    def doTransformation(self) -> np.ndarray:
+    # Calculates and applies a perspective transformation to an image,
+    # the marked source points are shown to the user only if requested
+    def doTransformation(self, pShowImage: bool = True) -> np.ndarray:
         # The coordinates of the points in the original image to be transformed
         pts1 = np.float32(self.points)
 
@@ -54,9 +56,10 @@ class PerspectiveTransformation:
         # Applying a perspective transformation to the source image
         transformedImage = cv2.warpPerspective(self.image, matrix, (int(self.dimensions[1]), int(self.dimensions[0])))
 
-        for x in range(0, 4):
-            cv2.circle(self.image, (int(pts1[x][0]), int(pts1[x][1])), 5, (255, 0, 0), cv2.FILLED)
+        if pShowImage:
+            for x in range(0, 4):
+                cv2.circle(self.image, (int(pts1[x][0]), int(pts1[x][1])), 5, (255, 0, 0), cv2.FILLED)
 
-        self.showImage()
+            self.showImage()
 
         return transformedImage
@@ -0,0 +1,50 @@
+from PIL import Image, ImageDraw
+import numpy as np
+import random
+import cv2
+
+
+class ResultRenderer:
+    # Returns the midpoint between two points
+    def midPoint(self, pPointA: tuple, pPointB: tuple) -> tuple:
+        return ((pPointA[0] + pPointB[0]) * 0.5, (pPointA[1] + pPointB[1]) * 0.5)
+
+    # Draws circles (x, y, r) with their order and lines labeled by the distances (i, j, mm)
+    # into a copy of the OpenCV image. The color of the centers is in BGR.
+    def renderWithCV(self, pImage: np.ndarray, pMarkers: list, pDistances: list,
+                     pCenterColor: tuple = (0, 0, 255)) -> np.ndarray:
+        image = pImage.copy()
+        for co, (x, y, r) in enumerate(pMarkers):
+            cv2.putText(image, "{:d}.".format(co), (int(x + 20), int(y + 20)), cv2.FONT_HERSHEY_SIMPLEX, 1,
+                        (0, 0, 0), 2)
+            cv2.circle(image, (int(x), int(y)), int(r), (0, 255, 0), 2)
+            cv2.circle(image, (int(x), int(y)), 2, pCenterColor, 3)
+
+        for i, j, distance in pDistances:
+            (x1, y1, _), (x2, y2, _) = pMarkers[i], pMarkers[j]
+            color = (random.randint(0, 255), random.randint(0, 255), random.randint(0, 255))
+            (mX, mY) = self.midPoint((x1, y1), (x2, y2))
+            cv2.line(image, (int(x1), int(y1)), (int(x2), int(y2)), color, 2)
+            cv2.putText(image, "{:.2f}mm".format(distance), (int(mX + 10), int(mY + 15)),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.7, color, 2)
+
+        return image
+
+    # Draws circles (x, y, r) with their order and lines labeled
+    # by the distances (i, j, mm) into a copy of the PIL image
+    def renderWithoutCV(self, pImage: Image.Image, pMarkers: list, pDistances: list) -> Image.Image:
+        image = Image.new("RGB", pImage.size)
+        image.paste(pImage)
+        draw = ImageDraw.Draw(image)
+        for co, (x, y, r) in enumerate(pMarkers):
+            draw.ellipse((x - r, y - r, x + r, y + r), outline=(255, 0, 0, 0))
+            draw.text((x, y), "{:d}.".format(co), (0, 0, 0))
+
+        for i, j, distance in pDistances:
+            (x1, y1, _), (x2, y2, _) = pMarkers[i], pMarkers[j]
+            color = (random.randint(0, 255), random.randint(0, 255), random.randint(0, 255))
+            (mX, mY) = self.midPoint((x1, y1), (x2, y2))
+            draw.line((x1, y1, x2, y2), color)
+            draw.text((int(mX), int(mY + 20)), "{:.2f}mm".format(distance), (83, 34, 171))
+
+        return image
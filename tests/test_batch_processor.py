@@ -0,0 +1,127 @@
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import batch_processor
+
+EXAMPLES = os.path.join(os.path.dirname(__file__), os.pardir, "input_images_examples")
+EXAMPLE = os.path.join(EXAMPLES, "image1.jpg")
+
+
+# Processor which hangs or kills its worker on images named so
+class FaultyProcessor(batch_processor.BatchProcessor):
+    def processImage(self, pImageFilename: str) -> dict:
+        name = os.path.basename(pImageFilename)
+        if name.startswith("hang"):
+            time.sleep(600)
+        if name.startswith("die"):
+            os._exit(1)
+
+        return {"image": pImageFilename, "success": True}
+
+
+# Creates empty images with the given names
+def createImages(pDirectory, pNames: list) -> str:
+    pDirectory.mkdir()
+    for name in pNames:
+        (pDirectory / name).write_bytes(b"")
+
+    return str(pDirectory)
+
+
+@pytest.fixture
+def paramsFilename(tmp_path) -> str:
+    filename = tmp_path / "params.json"
+    filename.write_text(json.dumps({"detector": "opencv", "method": 1, "minRadius": 20, "maxRadius": 40,
+                                    "objSize": 30, "numOfExpectedCircles": 7, "advancedDetection": True}))
+
+    return str(filename)
+
+
+def test_example_image_is_measured(tmp_path, paramsFilename, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    inputDir = tmp_path / "images"
+    inputDir.mkdir()
+    shutil.copy(EXAMPLE, str(inputDir))
+    processor = batch_processor.BatchProcessor(paramsFilename, str(tmp_path / "output"))
+
+    results = processor.processImages(str(inputDir))
+
+    assert len(results) == 1
+    assert results[0]["success"]
+    assert len(results[0]["markers"]) == 7
+    assert np.shape(results[0]["distanceMatrix"]) == (7, 7)
+    with open(tmp_path / "output" / "image1.json") as file:
+        assert json.load(file) == results[0]
+    assert not os.path.exists(tmp_path / "output" / "image1_detected.jpg")
+    assert sorted(os.listdir(tmp_path / "output")) == ["image1.json", "summary.json"]
+    assert sorted(os.listdir(tmp_path)) == ["images", "output", "params.json"]
+
+
+def test_annotated_image_is_rendered_on_request(tmp_path):
+    filename = tmp_path / "params.json"
+    filename.write_text(json.dumps({"detector": "opencv", "method": 1, "minRadius": 20, "maxRadius": 40,
+                                    "objSize": 30, "numOfExpectedCircles": 7, "renderImages": True}))
+    processor = batch_processor.BatchProcessor(str(filename), str(tmp_path / "output"))
+
+    result = processor.processImage(EXAMPLE)
+
+    with Image.open(tmp_path / "output" / "image1_detected.jpg") as image:
+        assert image.size == (1438, 1080)
+    assert len(result["markers"]) == 7
+
+
+def test_outputs_keep_relative_paths(tmp_path, paramsFilename):
+    images = [str(tmp_path / "a" / "x.png"), str(tmp_path / "b" / "x.png"), str(tmp_path / "b" / "y.png"),
+              str(tmp_path / "b" / "y.jpg")]
+    processor = batch_processor.BatchProcessor(paramsFilename, str(tmp_path / "output"))
+    processor.setOutputNames(str(tmp_path / "*" / "*"), images)
+
+    names = [os.path.relpath(processor.getOutputFilename(image, ".json"), str(tmp_path / "output"))
+             for image in images]
+
+    assert names == [os.path.join("a", "x.json"), os.path.join("b", "x.json"), os.path.join("b", "y_png.json"),
+                     os.path.join("b", "y_jpg.json")]
+
+
+def test_hung_and_dead_workers_fail_only_their_images(tmp_path, paramsFilename):
+    names = ["a.png", "b.png", "die.png", "c.png", "hang.png", "d.png"]
+    inputDir = createImages(tmp_path / "images", names)
+    processor = FaultyProcessor(paramsFilename, str(tmp_path / "output"))
+
+    results = processor.processImages(inputDir, 2, 2)
+
+    assert [os.path.basename(result["image"]) for result in results] == sorted(names)
+    failed = {os.path.basename(result["image"]): result["error"] for result in results if not result["success"]}
+    assert failed == {"die.png": "Worker process died", "hang.png": "Processing took more than 2 seconds"}
+
+
+def test_images_killing_every_pool_fail_after_retry_limit(tmp_path, paramsFilename):
+    inputDir = createImages(tmp_path / "images", ["die1.png", "die2.png", "die3.png"])
+    processor = FaultyProcessor(paramsFilename, str(tmp_path / "output"))
+
+    results = processor.processImages(inputDir, 3, 10)
+
+    assert [result["error"] for result in results] == ["Worker process died"] * 3
+
+
+# Radii of the parameter file and the markers are in pixels of the input image
+@pytest.mark.parametrize("usePyramid", [False, True])
+def test_markers_are_in_input_image_pixels(tmp_path, monkeypatch, usePyramid):
+    monkeypatch.chdir(tmp_path)
+    paramsFilename = tmp_path / "params.json"
+    paramsFilename.write_text(json.dumps({"minRadius": 70, "maxRadius": 110, "objSize": 30, "numOfExpectedCircles": 7,
+                                          "usePyramid": usePyramid}))
+    processor = batch_processor.BatchProcessor(str(paramsFilename), str(tmp_path / "output"))
+
+    result = processor.processImage(os.path.join(EXAMPLES, "image3.jpg"))
+
+    assert result["success"]
+    markers = sorted((marker["x"], marker["y"]) for marker in result["markers"])
+    expected = [(1316, 1212), (1330, 1006), (1496, 1112), (1700, 834), (1688, 1432), (1892, 1230), (1896, 996)]
+    np.testing.assert_allclose(markers, sorted(expected), atol=8)
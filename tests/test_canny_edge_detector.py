@@ -0,0 +1,75 @@
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import canny_edge_detector
+
+EXAMPLE = os.path.join(os.path.dirname(__file__), os.pardir, "input_images_examples", "image1.jpg")
+
+
+# Parts of the example image: a marker, two neighbouring markers and plain background
+@pytest.fixture(scope="module", params=[(690, 450, 770, 530), (590, 450, 690, 640), (0, 0, 60, 40)])
+def crop(request) -> Image.Image:
+    with Image.open(EXAMPLE) as image:
+        return image.crop(request.param)
+
+
+def test_numpy_engine_matches_loop_engine(crop):
+    loopEdges = canny_edge_detector.CannyEdgeDetector(crop, "loop").applyCannyEdgeDetector()
+    numpyEdges = canny_edge_detector.CannyEdgeDetector(crop, "numpy").applyCannyEdgeDetector()
+
+    np.testing.assert_array_equal(numpyEdges, loopEdges)
+
+
+def test_vectorized_blur_matches_loop_blur(crop):
+    detector = canny_edge_detector.CannyEdgeDetector(crop)
+    grayscale = detector.convertImageToGrayscaleVectorized()
+    np.testing.assert_array_equal(grayscale, detector.convertImageToGrayscale(crop.load(), *crop.size))
+
+    blurred = detector.blurImage(grayscale, *crop.size)
+    np.testing.assert_array_equal(detector.blurImageVectorized(grayscale), blurred)
+
+
+def test_marker_has_edges():
+    with Image.open(EXAMPLE) as image:
+        edges = canny_edge_detector.CannyEdgeDetector(image.crop((690, 450, 770, 530)), "numpy").applyCannyEdgeDetector()
+
+    assert len(edges) > 100
+
+
+def test_unknown_engine_is_rejected():
+    with Image.open(EXAMPLE) as image:
+        detector = canny_edge_detector.CannyEdgeDetector(image.crop((0, 0, 10, 10)), "gpu")
+
+    with pytest.raises(ValueError):
+        detector.applyCannyEdgeDetector()
+
+
+@pytest.mark.parametrize("workers", [1, 3, 8])
+def test_tiled_engine_matches_numpy_engine(crop, workers):
+    numpyEdges = canny_edge_detector.CannyEdgeDetector(crop, "numpy").applyCannyEdgeDetector()
+    tiledEdges = canny_edge_detector.CannyEdgeDetector(crop, "tiled", workers).applyCannyEdgeDetector()
+
+    np.testing.assert_array_equal(tiledEdges, numpyEdges)
+
+
+def test_labeled_hysteresis_matches_loop_hysteresis():
+    random = np.random.default_rng(7)
+    gradient = random.integers(0, 40, size=(50, 40)).astype(np.float64)
+    detector = canny_edge_detector.CannyEdgeDetector(None)
+
+    keep = detector.applyThresholdToFilterEdgesVectorized(gradient, 20, 25)
+    expected = detector.applyThresholdToFilterEdges(gradient, 50, 40, 20, 25)
+
+    assert sorted(map(tuple, np.argwhere(keep).tolist())) == sorted(expected)
+
+
+@pytest.mark.parametrize("engine", ["loop", "numpy", "tiled"])
+def test_edges_are_sorted_int32_coordinates(crop, engine):
+    edges = canny_edge_detector.CannyEdgeDetector(crop, engine).applyCannyEdgeDetector()
+
+    assert edges.dtype == np.int32
+    assert edges.shape[1] == 2
+    assert edges.tolist() == sorted(edges.tolist())
@@ -0,0 +1,116 @@
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+import circle_detector_with_cv
+
+EXAMPLES = os.path.join(os.path.dirname(__file__), os.pardir, "input_images_examples")
+
+
+def test_radius_windows_are_searched_once():
+    detector = circle_detector_with_cv.CircleDetectorWithCV(os.path.join(EXAMPLES, "image1.jpg"), 20, 40, 30, 7, 1)
+
+    circles = detector.detectCircles(detector.image, 20, 40)
+    edgedImage = detector.edgedImage
+
+    assert detector.detectCircles(detector.image, 20, 40) is circles
+    assert detector.detectCircles(detector.image, 25, 40) is not circles
+    assert detector.edgedImage is edgedImage
+    assert circles.shape[1] == 6
+
+
+def test_advanced_detection_finds_all_markers():
+    detector = circle_detector_with_cv.CircleDetectorWithCV(os.path.join(EXAMPLES, "image1.jpg"), 20, 40, 30, 7, 1)
+
+    circles, calls = detector.searchParameters(detector.maxDetectorCalls)
+
+    assert circles.shape[1] == 7
+    assert calls <= detector.maxDetectorCalls
+
+
+@pytest.mark.parametrize("cannyEngine", ["numpy", "tiled"])
+def test_canny_engines_find_all_markers(cannyEngine):
+    detector = circle_detector_with_cv.CircleDetectorWithCV(os.path.join(EXAMPLES, "image1.jpg"), 20, 40, 30, 7, 1,
+                                                            cannyEngine)
+
+    circles, calls = detector.searchParameters(detector.maxDetectorCalls)
+
+    assert circles.shape[1] == 7
+
+
+def test_tiled_engine_keeps_full_resolution():
+    detector = circle_detector_with_cv.CircleDetectorWithCV(os.path.join(EXAMPLES, "image3.jpg"), 70, 110, 30, 7, 1,
+                                                            "tiled")
+
+    circles, calls = detector.searchParameters(detector.maxDetectorCalls)
+
+    assert detector.image.shape[:2] == (2464, 3280)
+    assert circles.shape[1] == 7
+
+
+def test_pyramid_matches_resized_detection():
+    filename = os.path.join(EXAMPLES, "image3.jpg")
+    resizedDetector = circle_detector_with_cv.CircleDetectorWithCV(filename, 35, 55, 30, 7, 1)
+    pyramidDetector = circle_detector_with_cv.CircleDetectorWithCV(filename, 70, 110, 30, 7, 1, "opencv", True)
+
+    resizedCircles, calls = resizedDetector.searchParameters(resizedDetector.maxDetectorCalls)
+    pyramidCircles, calls = pyramidDetector.searchParameters(pyramidDetector.maxDetectorCalls)
+
+    assert (resizedDetector.scale, pyramidDetector.scale) == (0.5, 1.0)
+    expected = sorted((resizedCircles[0] / resizedDetector.scale).tolist())
+    np.testing.assert_allclose(sorted(pyramidCircles[0].tolist()), expected, atol=5)
+
+
+def test_prior_circles_are_found_without_searching_whole_image():
+    filename = os.path.join(EXAMPLES, "image1.jpg")
+    detector = circle_detector_with_cv.CircleDetectorWithCV(filename, 20, 40, 30, 6, 1)
+    circles = detector.detectCircles(detector.image, 20, 40)
+
+    priorDetector = circle_detector_with_cv.CircleDetectorWithCV(filename, 20, 40, 30, 6, 1)
+    priorDetector.setPriorCircles(circles[0].tolist())
+    priorCircles = priorDetector.detectCircles(priorDetector.image, 20, 40)
+
+    assert priorDetector.edgedImage is None
+    np.testing.assert_allclose(priorCircles[0], circles[0], atol=8)
+
+
+def test_refinement_finds_sub_pixel_center(tmp_path):
+    filename = str(tmp_path / "circle.png")
+    image = np.full((200, 200, 3), 255, dtype=np.uint8)
+    cv2.circle(image, (int(100.25 * 16), int(99.5 * 16)), 30 * 16, (0, 0, 0), -1, cv2.LINE_AA, 4)
+    cv2.imwrite(filename, image)
+    detector = circle_detector_with_cv.CircleDetectorWithCV(filename, 20, 40, 30, 1, 1)
+
+    x, y, r = detector.refineCircle(np.array([101, 99, 31]))
+
+    np.testing.assert_allclose((x, y), (100.25, 99.5), atol=0.1)
+    assert abs(r - 30) < 1
+
+
+def test_refinement_stays_on_detected_markers():
+    detector = circle_detector_with_cv.CircleDetectorWithCV(os.path.join(EXAMPLES, "image1.jpg"), 20, 40, 30, 7, 1)
+    circles, calls = detector.searchParameters(detector.maxDetectorCalls)
+
+    refinedCircles = detector.refineCircles(circles[0])
+
+    assert refinedCircles.shape == (7, 3)
+    np.testing.assert_allclose(refinedCircles, circles[0], atol=3)
+
+
+def test_headless_detection_only_measures(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    detector = circle_detector_with_cv.CircleDetectorWithCV(os.path.join(EXAMPLES, "image1.jpg"), 20, 40, 30, 6, 1)
+    detector.headless = True
+
+    assert detector.findAllCircles(1, 1) == (1, None)
+    assert len(detector.distance.distances) == 15
+    assert os.listdir(tmp_path) == []
+
+    detector.headless = False
+    value, image = detector.findAllCircles(1, 1)
+
+    assert image.shape == detector.image.shape
+    assert not np.array_equal(image, detector.image)
+    assert os.listdir(tmp_path) == ["result.json"]
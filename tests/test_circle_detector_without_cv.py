@@ -0,0 +1,130 @@
+import os
+from collections import defaultdict
+from math import cos, sin, pi
+
+import pytest
+from PIL import Image
+
+import circle_detector_without_cv
+
+EXAMPLE = os.path.join(os.path.dirname(__file__), os.pardir, "input_images_examples", "image1.jpg")
+
+
+# Saves a part of the example image, the detector only accepts filenames
+def cropExample(pDirectory, pBox: tuple) -> str:
+    filename = str(pDirectory / "crop.png")
+    with Image.open(EXAMPLE) as image:
+        image.crop(pBox).save(filename)
+
+    return filename
+
+
+# Hough Circle Transform as it was done with a dictionary accumulator
+def findCirclesByDictionary(pEdges: list, pMinRadius: int, pMaxRadius: int, pSteps: int, pThreshold: float) -> list:
+    points = [(r, int(r * cos(2 * pi * t / pSteps)), int(r * sin(2 * pi * t / pSteps)))
+              for r in range(pMinRadius, pMaxRadius + 1) for t in range(pSteps)]
+    acc = defaultdict(int)
+    for x, y in pEdges:
+        for r, dx, dy in points:
+            acc[(x - dx, y - dy, r)] += 1
+
+    circles = []
+    for (x, y, r), v in sorted(acc.items(), key=lambda i: -i[1]):
+        if v / pSteps >= pThreshold and all((x - xc) ** 2 + (y - yc) ** 2 > rc ** 2 for xc, yc, rc in circles):
+            circles.append((x, y, r))
+
+    return circles
+
+
+# Two markers of the left pair in the example image
+@pytest.fixture
+def twoMarkers(tmp_path) -> str:
+    return cropExample(tmp_path, (580, 440, 700, 640))
+
+
+@pytest.mark.parametrize("radii", [(30, 40), (34, 38)])
+def test_accumulator_matches_dictionary_accumulator(twoMarkers, radii):
+    detector = circle_detector_without_cv.CircleDetectorWithoutCV(twoMarkers, 30, 40, 30, 2, 1)
+
+    circles = detector.detectCircles(radii[0], radii[1], 0.4)
+    edges = detector.canny.applyCannyEdgeDetector()
+
+    assert sorted(circles) == sorted(findCirclesByDictionary(edges, radii[0], radii[1], detector.steps, 0.4))
+    assert len(circles) == 2
+
+
+def test_window_reuses_radius_layers(twoMarkers):
+    detector = circle_detector_without_cv.CircleDetectorWithoutCV(twoMarkers, 30, 40, 30, 2, 1)
+
+    first = detector.detectCircles(30, 40, 0.4)
+    layer = detector.radiusLayers[36]
+    second = detector.detectCircles(34, 38, 0.4)
+
+    assert detector.radiusLayers[36] is layer
+    assert sorted(detector.radiusLayers) == list(range(30, 41))
+    assert sorted(first) == sorted(second)
+
+
+def test_radius_layers_are_bounded(twoMarkers):
+    detector = circle_detector_without_cv.CircleDetectorWithoutCV(twoMarkers, 30, 40, 30, 2, 1)
+    detector.maxRadiusLayers = 8
+
+    detector.detectCircles(30, 40, 0.4)
+    assert len(detector.radiusLayers) == 11
+
+    detector.detectCircles(34, 36, 0.4)
+    detector.detectCircles(20, 22, 0.4)
+
+    assert len(detector.radiusLayers) == 8
+    assert {20, 21, 22, 34, 35, 36} <= set(detector.radiusLayers)
+
+
+@pytest.mark.parametrize("radii", [(20, 24), (10, 60)])
+def test_advanced_detection_finds_both_markers(twoMarkers, radii):
+    detector = circle_detector_without_cv.CircleDetectorWithoutCV(twoMarkers, radii[0], radii[1], 30, 2, 1)
+
+    circles, calls = detector.searchParameters(detector.maxDetectorCalls)
+
+    assert len(circles) == 2
+    assert calls <= detector.maxDetectorCalls
+
+
+def test_tiled_engine_detects_same_circles(twoMarkers):
+    numpyDetector = circle_detector_without_cv.CircleDetectorWithoutCV(twoMarkers, 30, 40, 30, 2, 1)
+    tiledDetector = circle_detector_without_cv.CircleDetectorWithoutCV(twoMarkers, 30, 40, 30, 2, 1, "tiled")
+
+    assert tiledDetector.detectCircles(30, 40, 0.4) == numpyDetector.detectCircles(30, 40, 0.4)
+
+
+def test_gradient_voting_finds_same_markers(twoMarkers):
+    detector = circle_detector_without_cv.CircleDetectorWithoutCV(twoMarkers, 30, 40, 30, 2, 1)
+    fullCircles = detector.detectCircles(30, 40, 0.4)
+
+    detector.setVotingMode("gradient")
+
+    assert len(detector.radiusLayers) == 0
+    assert sorted(detector.detectCircles(30, 40, 0.4)) == sorted(fullCircles)
+    with pytest.raises(ValueError):
+        detector.setVotingMode("random")
+
+
+def test_prior_circles_are_found_without_voting_whole_image(twoMarkers):
+    detector = circle_detector_without_cv.CircleDetectorWithoutCV(twoMarkers, 30, 40, 30, 2, 1)
+    circles = detector.detectCircles(30, 40, 0.4)
+
+    priorDetector = circle_detector_without_cv.CircleDetectorWithoutCV(twoMarkers, 30, 40, 30, 2, 1)
+    priorDetector.setPriorCircles(circles)
+
+    assert sorted(priorDetector.detectCircles(30, 40, 0.4)) == sorted(circles)
+    assert len(priorDetector.radiusLayers) == 0
+
+
+def test_offset_tables_are_shared_and_read_only():
+    offsets, counts, stepIndex = circle_detector_without_cv.getOffsetTable(36, 100)
+    points = [(int(36 * cos(2 * pi * t / 100)), int(36 * sin(2 * pi * t / 100))) for t in range(100)]
+
+    assert [tuple(offset) for offset in offsets[stepIndex]] == points
+    assert counts.sum() == 100
+    assert circle_detector_without_cv.getOffsetTables(35, 37, 100)[36][0] is offsets
+    with pytest.raises(ValueError):
+        offsets[0, 0] = 0
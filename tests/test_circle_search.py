@@ -0,0 +1,42 @@
+import circle_search
+
+
+# Detector whose count of circles grows with the widening of the radius window
+def fakeDetector(pNeeded: int):
+    return lambda pParams: list(range(max(pParams[0] + pNeeded, 0)))
+
+
+def test_bisect_finds_expected_count():
+    search = circle_search.ParameterSearch(fakeDetector(0), len, 7, 30)
+
+    search.bisect(lambda v: (v,), 0, 100)
+
+    assert search.error == 0
+    assert search.params == (7,)
+    assert search.calls <= 8
+
+
+def test_search_stops_after_max_calls():
+    search = circle_search.ParameterSearch(lambda pParams: [], len, 7, 5)
+
+    search.searchRadiusWindow(lambda i: (i,), 10, 20)
+    search.bisect(lambda v: (v,), -100, 100)
+
+    assert search.calls == 5
+    assert search.circles == []
+    assert search.error == 7
+
+
+def test_radius_window_is_narrowed_when_too_many_circles():
+    search = circle_search.ParameterSearch(fakeDetector(12), len, 7, 30)
+
+    search.searchRadiusWindow(lambda i: (i,), 10, 30)
+
+    assert search.error == 0
+    assert search.params == (-5,)
+
+
+def test_radius_window_grows_with_radius():
+    assert circle_search.getRadiusWindow(20, 10) == (10, 30)
+    assert circle_search.getRadiusWindow(150.6, 10) == (135, 165)
+    assert circle_search.getRadiusWindow(3, 0) == (2, 4)
@@ -0,0 +1,45 @@
+import os
+
+import numpy as np
+
+import circle_detector_with_cv
+import corner_detector
+
+EXAMPLES = os.path.join(os.path.dirname(__file__), os.pardir, "input_images_examples")
+
+
+def test_corners_in_circles_give_same_midpoints():
+    detector = circle_detector_with_cv.CircleDetectorWithCV(os.path.join(EXAMPLES, "image1.jpg"), 20, 40, 30, 7, 1)
+    circles, calls = detector.searchParameters(detector.maxDetectorCalls)
+    coordsX, coordsY, radii = (circles[0][:, k].tolist() for k in range(3))
+
+    midpoints = detector.corners.findMidpointsOfCircles(coordsX[:], coordsY[:], radii[:])
+    detector.corners.searchInCircles = True
+
+    assert detector.corners.findMidpointsOfCircles(coordsX[:], coordsY[:], radii[:]) == midpoints
+    assert len(midpoints[0]) == 6
+
+
+def test_kd_tree_matches_nearest_corner_in_box():
+    detector = circle_detector_with_cv.CircleDetectorWithCV(os.path.join(EXAMPLES, "image1.jpg"), 20, 40, 30, 7, 1)
+    circles, calls = detector.searchParameters(detector.maxDetectorCalls)
+    corners = detector.corners.detectCorners()[1:]
+
+    assigned = detector.corners.assignCornersToCircles(corners, *(circles[0][:, k].tolist() for k in range(3)))
+
+    for (x, y, r), corner in zip(circles[0], assigned):
+        inBox = [c for c in corners if abs(c[0] - x) <= r and abs(c[1] - y) <= r]
+        if not inBox:
+            assert corner is None
+            continue
+        nearest = min(inBox, key=lambda c: np.hypot(c[0] - x, c[1] - y))
+        np.testing.assert_allclose(corner, nearest)
+
+
+def test_overlapping_boxes_keep_both_circles():
+    corners = np.array([[100.0, 100.0], [130.0, 100.0]])
+    detector = corner_detector.CornerDetector(np.zeros((200, 200, 3), dtype=np.uint8), 2, 1)
+
+    assigned = detector.assignCornersToCircles(corners, [105, 110], [100, 100], [30, 30])
+
+    np.testing.assert_array_equal(assigned, corners)
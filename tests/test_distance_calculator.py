@@ -0,0 +1,46 @@
+import json
+import math
+
+import numpy as np
+
+import distance_calculator
+
+
+def test_distance_matrix_matches_pairwise_distances(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    coordsX, coordsY, radii = [727, 637, 803, 636, 882], [489, 501, 678, 587, 587], [26, 38, 37, 40, 39]
+    distance = distance_calculator.DistanceCalculator(30)
+
+    matrix = distance.findAllDistances(coordsX, coordsY, radii)
+
+    sizeOfOnePixel = 30 / ((2 * sum(radii) - 2 * max(radii)) / (len(radii) - 1))
+    for i, j, d in distance.distances:
+        assert math.isclose(d, math.hypot(coordsX[i] - coordsX[j], coordsY[i] - coordsY[j]) * sizeOfOnePixel)
+        assert matrix[i, j] == matrix[j, i] == d
+    assert len(distance.distances) == 10
+    np.testing.assert_array_equal(np.diag(matrix), 0)
+    assert list(tmp_path.iterdir()) == []
+    assert capsys.readouterr().out == ""
+
+
+def test_axis_aligned_distance_is_in_millimeters():
+    distance = distance_calculator.DistanceCalculator(30)
+    distance.setAverageDiameter([15, 15])
+
+    assert distance.calculateDistance((0, 0), (60, 0)) == 60
+    assert distance.calculateDistance((0, 0), (0, 60)) == 60
+
+
+def test_results_file_round_trip(tmp_path):
+    distance = distance_calculator.DistanceCalculator(30)
+    distance.scale = 0.5
+    distance.findAllDistances([364, 319, 402], [245, 251, 339], [13, 19, 18])
+    filename = str(tmp_path / "result.json")
+
+    distance.writeResults(filename)
+
+    np.testing.assert_allclose(distance_calculator.loadMeasurements(filename), [d for i, j, d in distance.distances])
+    with open(filename) as file:
+        results = json.load(file)
+    assert results["markers"][0] == {"x": 728.0, "y": 490.0, "radius": 26.0}
+    assert results["averageDiameter"] == 2 * distance.getAverageDiameter()
@@ -0,0 +1,131 @@
+import os
+
+import numpy as np
+import pytest
+
+import circle_detector_with_cv
+import find_markers_positions
+
+EXAMPLES = os.path.join(os.path.dirname(__file__), os.pardir, "input_images_examples")
+
+
+# Distances of a regular hexagon of markers with the nozzle 20 mm below its center
+def createMeasurements(pNoise: float) -> np.ndarray:
+    markers = [(60 * np.cos(a), 60 * np.sin(a), 0) for a in np.arange(-2, 4) * np.pi / 3]
+    positions = np.vstack(([0.0, 0.0, -20.0], markers))
+    first, second = np.triu_indices(7, k=1)
+    measurements = np.linalg.norm(positions[first] - positions[second], axis=1)
+
+    return measurements + np.random.default_rng(4).normal(scale=pNoise, size=21)
+
+
+@pytest.fixture
+def finder() -> find_markers_positions.FindMarkersPositions:
+    return find_markers_positions.FindMarkersPositions()
+
+
+@pytest.mark.parametrize("numOfMarkers", [6, 7])
+def test_residuals_match_pair_distances(finder, numOfMarkers):
+    positions = np.random.default_rng(1).normal(scale=50, size=(numOfMarkers, 3))
+    measurements = np.random.default_rng(2).uniform(20, 80, size=numOfMarkers * (numOfMarkers - 1) // 2)
+
+    pairs = [(i, j) for i in range(numOfMarkers) for j in range(i + 1, numOfMarkers)]
+    expected = [np.linalg.norm(positions[i] - positions[j]) - m for (i, j), m in zip(pairs, measurements)]
+
+    np.testing.assert_allclose(finder.residuals(positions, measurements), expected)
+
+
+def test_jacobian_matches_finite_differences(finder):
+    positions = np.random.default_rng(3).normal(scale=50, size=(7, 3))
+    measurements = np.zeros(21)
+    step = 1e-6
+
+    numerical = np.empty((21, 21))
+    for k in range(21):
+        shift = np.zeros(21)
+        shift[k] = step
+        plus = finder.residuals(positions + shift.reshape(7, 3), measurements)
+        minus = finder.residuals(positions - shift.reshape(7, 3), measurements)
+        numerical[:, k] = (plus - minus) / (2 * step)
+
+    np.testing.assert_allclose(finder.residualsJacobian(positions), numerical, atol=1e-6)
+
+
+def test_jacobian_of_coincident_markers_is_finite(finder):
+    jacobian = finder.residualsJacobian(np.zeros((6, 3)))
+
+    assert np.all(np.isfinite(jacobian))
+    np.testing.assert_allclose(np.linalg.norm(jacobian[:, :3], axis=1)[:5], 1)
+
+
+def test_least_squares_keeps_statistics_of_both_stages(finder, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr("builtins.input", lambda *args: "10")
+
+    finder.solve(createMeasurements(0.1), "least_squares")
+
+    intermediate, final = finder.statistics["intermediate"], finder.statistics["final"]
+    assert list(intermediate["residuals"])[:2] == ["M0-M1", "M0-M2"]
+    assert list(final["residuals"])[:2] == ["Nozzle-M0", "Nozzle-M1"]
+    assert np.shape(intermediate["covariance"]) == (9, 9) and np.shape(final["covariance"]) == (3, 3)
+    for statistics in (intermediate, final):
+        np.testing.assert_allclose(statistics["standardErrors"], np.sqrt(np.diag(statistics["covariance"])))
+        assert 0 < max(statistics["standardErrors"]) < 1
+        assert max(abs(residual) for residual in statistics["residuals"].values()) < 0.5
+
+
+# Measurements of the markers detected in the example image
+@pytest.fixture(scope="module")
+def exampleMeasurements() -> np.ndarray:
+    detector = circle_detector_with_cv.CircleDetectorWithCV(os.path.join(EXAMPLES, "image3.jpg"), 35, 55, 30, 7, 1)
+    detector.headless = True
+    assert detector.findAllCircles(1, 0)[0] == 1
+    first, second = np.triu_indices(7, k=1)
+
+    return detector.distance.distanceMatrix[first, second]
+
+
+def test_multi_start_escapes_local_minimum_of_zero_start(finder, exampleMeasurements):
+    markerMeasurements = exampleMeasurements[6:]
+
+    zeroCost, zeroSolution = finder.solveWithoutNozzle(markerMeasurements, "SLSQP", None, False)
+    finder.numOfStarts = 4
+    finder.numOfWorkers = 2
+    cost, solution = finder.solveMultiStart(markerMeasurements, "SLSQP")
+
+    assert len(finder.multiStartCosts) == 4
+    assert cost == finder.multiStartCosts.min()
+    assert cost < 1e-6 < zeroCost
+
+
+def test_closed_form_recovers_exact_layout(finder):
+    measurements = createMeasurements(0.0)
+
+    cost, solution = finder.solveWithoutNozzle(measurements[6:], "MDS", None, False)
+
+    assert cost < 1e-12
+    np.testing.assert_allclose(finder.trilaterateNozzle(solution, measurements[:6]), (30, 51.96152, -20), atol=1e-4)
+
+
+def test_warm_start_reaches_global_minimum(finder, exampleMeasurements):
+    guess = finder.classicalMdsGuess(exampleMeasurements[6:])
+
+    cost, solution = finder.solveWithoutNozzle(exampleMeasurements[6:], "SLSQP", guess, False)
+
+    assert cost < 1e-6
+
+
+def test_many_sets_are_solved_quietly(finder, tmp_path, monkeypatch, capfd):
+    monkeypatch.chdir(tmp_path)
+    measurementSets = [createMeasurements(0.0), createMeasurements(0.1)[6:], np.ones(10)]
+
+    results = finder.solveMany(measurementSets, "least_squares", 10.0, 2)
+
+    assert [result["index"] for result in results] == [0, 1, 2]
+    assert results[0]["finalCost"] < 1e-9
+    np.testing.assert_allclose(np.array(results[0]["positions"])[:, 2], 10.0)
+    assert set(results[0]["statistics"]) == {"intermediate", "final"}
+    assert results[1]["finalCost"] is None and set(results[1]["statistics"]) == {"intermediate"}
+    assert "error" in results[2]
+    assert capfd.readouterr().out == ""
+    assert os.listdir(tmp_path) == []
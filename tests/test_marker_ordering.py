@@ -0,0 +1,45 @@
+import os
+from math import cos, sin, pi
+
+import numpy as np
+import pytest
+
+import circle_detector_with_cv
+import marker_ordering
+
+EXAMPLES = os.path.join(os.path.dirname(__file__), os.pardir, "input_images_examples")
+
+
+# Nozzle in the middle of three pairs of markers, the pair of anchor B lies at the bottom
+def createRing(pRotation: float) -> (list, list):
+    angles = [pi / 2 + s * 0.3 + k * 2 * pi / 3 + pRotation for k in range(3) for s in (-1, 1)]
+
+    return [500.0] + [500 + 100 * cos(a) for a in angles], [400.0] + [400 + 100 * sin(a) for a in angles]
+
+
+def test_order_does_not_depend_on_detection_order():
+    detector = circle_detector_with_cv.CircleDetectorWithCV(os.path.join(EXAMPLES, "image1.jpg"), 20, 40, 30, 7, 1)
+    circles, calls = detector.searchParameters(detector.maxDetectorCalls)
+
+    ordered = detector.sortCircles(circles)
+    shuffled = detector.sortCircles(circles[:, np.random.default_rng(3).permutation(7)])
+
+    np.testing.assert_array_equal(shuffled, ordered)
+    np.testing.assert_allclose(ordered[0, :2], (727.5, 489.5))
+
+
+@pytest.mark.parametrize("rotation", [-0.2, 0.0, 0.2])
+def test_small_rotation_keeps_order(rotation):
+    xs, ys = createRing(rotation)
+
+    order = marker_ordering.orderMarkers(xs, ys)
+
+    assert order.tolist() == [0, 1, 6, 5, 4, 3, 2]
+
+
+def test_markers_without_nozzle_are_ordered():
+    xs, ys = createRing(0.0)
+
+    order = marker_ordering.orderMarkers(xs[1:], ys[1:], marker_ordering.hasNozzle(6))
+
+    assert order.tolist() == [0, 5, 4, 3, 2, 1]